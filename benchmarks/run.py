@@ -0,0 +1,244 @@
+"""Time perg's hot paths on synthetic repos, and compare the results against a saved baseline.
+
+    python -m benchmarks.run --scale small medium --save baseline.json
+    ... make changes ...
+    python -m benchmarks.run --scale small medium --baseline baseline.json
+
+Each stage of a perg run is measured separately:
+
+- walk: finding files (find_files)
+- parse: running the syntaxes over every file
+- check: running each pattern's checkers against the queries (including the prefilter)
+- first_pass: the cheap heuristics (pattern_matches_empty, pattern_matches_single_char, ...)
+- score: scoring the surviving matches with heuristics.information
+
+Times are the best of --repeat runs, each starting with perg's caches cleared, so they reflect a fresh
+`perg` invocation. Peak memory comes from one extra run under tracemalloc, since tracing slows
+everything down. With --baseline, any stage that got slower or bigger by more than --threshold is
+reported as a regression, and the exit status is 1.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+
+import perg
+from benchmarks.synthetic import QUERIES
+from benchmarks.synthetic import SCALES
+from benchmarks.synthetic import generate_repo
+from perg import common_checkers
+from perg import heuristics
+from perg import nfa
+from perg import prefilter
+from perg.perg import find_files
+from perg.perg import find_syntaxes
+from perg.perg import match_pattern
+from perg.perg import parse_args
+from perg.perg import parse_file_patterns
+from perg.perg import passes_heuristics_first_pass
+from perg.perg import score_matches
+from perg.syntaxes import LazySyntax
+
+
+STAGES = ('walk', 'parse', 'check', 'first_pass', 'score')
+
+# Differences smaller than these are noise, whatever the ratio.
+MIN_SECONDS_DIFFERENCE = 0.005
+MIN_BYTES_DIFFERENCE = 256 * 1024
+
+
+def clear_caches() -> None:
+    """Clear every lru_cache in perg, so each run starts cold."""
+    # The syntaxes are imported here if they weren't yet; the LazySyntax entries don't hold the caches.
+    syntaxes = [syntax.module if isinstance(syntax, LazySyntax) else syntax for syntax in find_syntaxes()]
+    modules = [perg, common_checkers, heuristics, nfa, prefilter, *syntaxes]
+    for module in modules:
+        for value in vars(module).values():
+            if hasattr(value, 'cache_clear') and not isinstance(value, type):
+                value.cache_clear()
+
+
+def run_stages(repo: str, args, timer: Callable[[str], Any]) -> Dict[str, int]:
+    """Run a whole search over repo, one stage at a time. `timer(stage)` is a context manager
+    wrapped around each stage. Returns how many things each stage produced."""
+    counts = {}
+    all_syntaxes = find_syntaxes()
+
+    with timer('walk'):
+        filenames = list(find_files([repo]))
+    counts['walk'] = len(filenames)
+
+    with timer('parse'):
+        patterns = [
+            pattern
+            for filename in filenames
+            for _syntax, syntax_patterns in parse_file_patterns(filename, all_syntaxes, args)
+            for pattern in syntax_patterns
+        ]
+    counts['parse'] = len(patterns)
+
+    with timer('check'):
+        matches = [match for pattern in patterns for text in args.texts for match in match_pattern(pattern, text, args.partial)]
+    counts['check'] = len(matches)
+
+    with timer('first_pass'):
+        matches = [match for match in matches if passes_heuristics_first_pass(match, args)]
+    counts['first_pass'] = len(matches)
+
+    with timer('score'):
+        scored = [
+            scored_match
+            for text in args.texts
+            for scored_match in score_matches({match for match in matches if match.text == text}, args)
+        ]
+    counts['score'] = len(scored)
+    return counts
+
+
+class _Timer:
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.cpu_seconds: Dict[str, float] = {}
+
+    def __call__(self, stage: str):
+        self.stage = stage
+        return self
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def __exit__(self, *exc_info):
+        self.seconds[self.stage] = time.perf_counter() - self.start
+        self.cpu_seconds[self.stage] = time.process_time() - self.cpu_start
+
+
+class _MemoryTracer:
+    def __init__(self):
+        self.peak_bytes: Dict[str, int] = {}
+
+    def __call__(self, stage: str):
+        self.stage = stage
+        return self
+
+    def __enter__(self):
+        self.start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+    def __exit__(self, *exc_info):
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak_bytes[self.stage] = peak - self.start
+
+
+def benchmark(repo: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    args = parse_args(['--queries-from', '/dev/null', repo])
+    args.texts = QUERIES
+
+    best: Dict[str, Dict[str, float]] = {}
+    for _ in range(repeat):
+        clear_caches()
+        timer = _Timer()
+        counts = run_stages(repo, args, timer)
+        for stage in STAGES:
+            result = best.setdefault(stage, {'seconds': float('inf'), 'cpu_seconds': float('inf')})
+            result['seconds'] = min(result['seconds'], timer.seconds[stage])
+            result['cpu_seconds'] = min(result['cpu_seconds'], timer.cpu_seconds[stage])
+            result['count'] = counts[stage]
+
+    clear_caches()
+    tracer = _MemoryTracer()
+    tracemalloc.start()
+    try:
+        run_stages(repo, args, tracer)
+    finally:
+        tracemalloc.stop()
+    for stage in STAGES:
+        best[stage]['peak_bytes'] = tracer.peak_bytes[stage]
+    return best
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    for scale, stages in results['scales'].items():
+        baseline_stages = baseline.get('scales', {}).get(scale)
+        if baseline_stages is None:
+            continue
+        for stage, result in stages.items():
+            if stage not in baseline_stages:
+                continue
+            for metric, min_difference in (('seconds', MIN_SECONDS_DIFFERENCE), ('peak_bytes', MIN_BYTES_DIFFERENCE)):
+                old, new = baseline_stages[stage][metric], result[metric]
+                if new > old * (1 + threshold) and new - old > min_difference:
+                    change = f"{new / old - 1:+.0%}" if old else "n/a"
+                    regressions.append(f"{scale}/{stage}: {metric} went from {old:.4g} to {new:.4g} ({change})")
+            if baseline_stages[stage].get('count') != result['count']:
+                # Not a performance regression, but it means the numbers aren't comparable.
+                regressions.append(
+                    f"{scale}/{stage}: produced {result['count']} results, vs {baseline_stages[stage].get('count')} in the baseline"
+                )
+    return regressions
+
+
+def print_table(results: Dict[str, Any]) -> None:
+    print(f"{'scale':<8} {'stage':<12} {'count':>8} {'seconds':>10} {'cpu':>10} {'peak MiB':>10}")
+    for scale, stages in results['scales'].items():
+        for stage, result in stages.items():
+            print(
+                f"{scale:<8} {stage:<12} {result['count']:>8} {result['seconds']:>10.4f} "
+                f"{result['cpu_seconds']:>10.4f} {result['peak_bytes'] / 2**20:>10.2f}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', nargs='+', choices=sorted(SCALES), default=['small'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', type=str, default=None, metavar='FILE', help="Write the results to FILE as JSON.")
+    parser.add_argument('--baseline', type=str, default=None, metavar='FILE', help="Compare against results saved with --save.")
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.25,
+        help="How much slower or bigger (as a fraction) a stage can get before it's a regression.",
+    )
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': args.seed,
+        'scales': {},
+    }
+    for scale in args.scale:
+        with tempfile.TemporaryDirectory(prefix=f'perg-bench-{scale}-') as repo:
+            generate_repo(repo, scale, args.seed)
+            results['scales'][scale] = benchmark(repo, args.repeat)
+
+    print_table(results)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
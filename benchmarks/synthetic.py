@@ -0,0 +1,128 @@
+"""Generate a synthetic repo for benchmarking perg.
+
+The repo is deterministic for a given scale and seed, and mixes the kinds of patterns perg cares
+about -- python f-strings, %- and {}-format strings, regex literals, and bash strings and heredocs --
+with plenty of ordinary code and strings that don't match anything, like a real codebase would have.
+"""
+
+import argparse
+import os
+import random
+from typing import Dict
+from typing import List
+
+
+# name -> (python files, bash files, other files, functions per python file)
+SCALES: Dict[str, tuple] = {
+    'small': (20, 5, 5, 10),
+    'medium': (200, 40, 40, 20),
+    'large': (1000, 200, 200, 40),
+}
+
+# Texts to search for; each one matches a few of the generated patterns.
+QUERIES: List[str] = [
+    "GET /api/v1/users/12345/orders",
+    "User alice logged in from 10.0.0.1",
+    "backup-2024-01-01.tar.gz",
+    "Processed 42 records in 3.5s",
+]
+
+WORDS = [
+    'user', 'order', 'invoice', 'account', 'session', 'token', 'widget', 'report', 'cache',
+    'queue', 'worker', 'backup', 'record', 'request', 'payment', 'shipment',
+]
+
+
+def _python_function(rng: random.Random, i: int) -> str:
+    word = rng.choice(WORDS)
+    kind = rng.randrange(8)
+    if kind == 0:
+        body = 'log.info(f"User {name} logged in from {ip}")'
+    elif kind == 1:
+        body = f'log.info("Processed %d {word}s in %.1fs", n, elapsed)'
+    elif kind == 2:
+        body = f'route = "/api/v1/{word}s/{{{word}_id}}/orders".format({word}_id=x)'
+    elif kind == 3:
+        body = f'pattern = re.compile(r"^/api/v[0-9]+/{word}s/[0-9]+(/\\w+)?$")'
+    elif kind == 4:
+        body = f'message = f"Processed {{count}} records in {{seconds:.1f}}s ({word})"'
+    elif kind == 5:
+        body = f'raise ValueError("invalid {word}: " + repr(x))'
+    elif kind == 6:
+        body = 'return "%s-%s" % (a, b)'
+    else:
+        body = f'return {{"{word}": x, "id": {i}, "label": "{word} #{i}"}}'
+    return f'''
+
+def {rng.choice(WORDS)}_{i}(x, n=0, name=None, ip=None, count=0, seconds=0.0, elapsed=0.0, a=None, b=None):
+    """Do something with a {rng.choice(WORDS)}."""
+    if x is None:
+        return None
+    {body}
+'''
+
+
+def python_file(rng: random.Random, functions: int) -> str:
+    return 'import logging\nimport re\n\nlog = logging.getLogger(__name__)\n' + ''.join(
+        _python_function(rng, i) for i in range(functions)
+    )
+
+
+def bash_file(rng: random.Random, commands: int) -> str:
+    lines = ['#!/bin/bash', 'set -euo pipefail', '']
+    for i in range(commands):
+        word = rng.choice(WORDS)
+        kind = rng.randrange(5)
+        if kind == 0:
+            lines.append(f'tar czf "backup-$(date +%Y-%m-%d).tar.gz" /var/lib/{word}')
+        elif kind == 1:
+            lines.append(f'echo "Processed $count {word}s in ${{elapsed}}s"')
+        elif kind == 2:
+            lines.extend([f'cat > /tmp/{word}.conf <<EOF', 'name = $NAME', f'path = /srv/{word}/$ID', 'EOF'])
+        elif kind == 3:
+            lines.append(f"ls /var/log/{word}-*.log | xargs grep -c 'ERROR'")
+        else:
+            lines.append(f'curl -s "http://localhost:8080/api/v1/{word}s/$ID/orders"')
+    return '\n'.join(lines) + '\n'
+
+
+def other_file(rng: random.Random, lines: int) -> str:
+    # Plain text and config-ish files, which only the general syntax looks at.
+    return ''.join(
+        f"{rng.choice(WORDS)}_{i} = \"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}\"\n" for i in range(lines)
+    )
+
+
+def generate_repo(root: str, scale: str = 'small', seed: int = 0) -> str:
+    """Write a synthetic repo under root, returning root."""
+    python_files, bash_files, other_files, functions = SCALES[scale]
+    rng = random.Random(seed)
+    for i in range(python_files):
+        directory = os.path.join(root, 'src', f'package{i % 10}')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'module{i}.py'), 'w') as f:
+            f.write(python_file(rng, functions))
+    for i in range(bash_files):
+        directory = os.path.join(root, 'scripts')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'script{i}.sh'), 'w') as f:
+            f.write(bash_file(rng, functions))
+    for i in range(other_files):
+        directory = os.path.join(root, 'config')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'settings{i}.txt'), 'w') as f:
+            f.write(other_file(rng, functions))
+    return root
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('root', type=str, help="Where to write the repo.")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_repo(args.root, args.scale, args.seed)
+
+
+if __name__ == '__main__':
+    main()
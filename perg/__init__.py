@@ -1,8 +1,10 @@
 from dataclasses import dataclass
-from functools import cached_property
+from dataclasses import field
+from functools import lru_cache
 from functools import total_ordering
 from typing import Callable
 from typing import Generic
+from typing import Hashable
 from typing import Protocol
 from typing import Tuple
 from typing import IO
@@ -11,11 +13,16 @@ from typing import Optional
 
 from perg.color import RED
 from perg.color import RESET
+from perg.source import line_index
 
 
 
+# Indexing a big repo makes millions of Locations and Patterns, so these are all slotted: no
+# per-instance __dict__.
+
+
 @total_ordering
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Location:
     filename: str
     start_lineno: int
@@ -40,8 +47,7 @@ class Location:
         )
 
     def print_highlighted(self, before=0, context=0, after=0):
-        with open(self.filename) as f:
-            lines = [line.rstrip('\n') for line in f]
+        lines = line_index(self.filename)
 
         def prefix_unpadded(lineno):
             if lineno == self.start_lineno:
@@ -62,10 +68,10 @@ class Location:
             before_context_lines = max(before, context)
             start_context = max(1, self.start_lineno - before_context_lines)
             for lineno in range(start_context, self.start_lineno):
-                print(f"{prefix(lineno)} {lines[lineno-1]}")
+                print(f"{prefix(lineno)} {lines.line(lineno)}")
 
         for lineno in range(self.start_lineno, self.end_lineno+1):
-            line = lines[lineno-1]
+            line = lines.line(lineno)
             if lineno == self.start_lineno:
                 highlight_begin = self.start_col
             else:
@@ -84,21 +90,22 @@ class Location:
             after_context_lines = max(after, context)
             end_context = min(len(lines), self.end_lineno + after_context_lines)
             for lineno in range(self.end_lineno+1, end_context):
-                line = lines[lineno-1]
+                line = lines.line(lineno)
                 print(f"{prefix(lineno)} {line}")
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CheckResult:
     text: str
     spans: Tuple[Tuple[int, int], ...]  # the spans (start, end) of text which matched.
 
 
-T = TypeVar('T')
+# Pattern values must be hashable, since patterns and matches are (and check results are cached).
+T = TypeVar('T', bound=Hashable)
 CheckFunction = Callable[[T, str, int], Optional[CheckResult]]
 
 
 @total_ordering
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Pattern(Generic[T]):
     location: Location
     value: T
@@ -119,23 +126,36 @@ class NoMatchError(Exception):
     pass
 
 
+# The same literals turn up all over a codebase ("%s", "*", common log prefixes, ...), so each one is
+# checked against a text once, rather than once for every place it appears.
+CHECK_CACHE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=CHECK_CACHE_SIZE)
+def check_result(check_fn: CheckFunction[T], value: T, text: str, partial: int) -> Optional[CheckResult]:
+    """check_fn(value, text, partial), remembering the results."""
+    return check_fn(value, text, partial)
+
+
+def checker_name(check_fn: CheckFunction) -> str:
+    """The name a checker is shown by, e.g. with --print-checker-names."""
+    return getattr(check_fn, '__name__', repr(check_fn))
+
+
 @total_ordering
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Match(Generic[T]):
     check_fn: CheckFunction[T]
     pattern: Pattern[T]
     text: str
     partial: bool
+    result: CheckResult = field(init=False, repr=False, compare=False)
 
     def __post_init__(self):
-        self.result
-
-    @cached_property
-    def result(self):
-        result = self.check_fn(self.pattern.value, self.text, self.partial)
+        result = check_result(self.check_fn, self.pattern.value, self.text, self.partial)
         if not result:
             raise NoMatchError()
-        return result
+        object.__setattr__(self, 'result', result)
 
     def __lt__(self, other):
         assert isinstance(other, Match)
@@ -150,7 +170,7 @@ class Match(Generic[T]):
         )
 
 
-DEBUG = False
+DEBUG: bool = False
 
 def debug(s):
     if DEBUG:
@@ -158,5 +178,8 @@ def debug(s):
 
 
 class Syntax(Protocol):
+    # The syntax's module name, e.g. "perg.syntaxes.python", which the pattern cache keys on.
+    __name__: str
+
     def parse(self, f: IO, filename: str):
         ...
@@ -0,0 +1,16 @@
+"""Python's own regex parser, which perg.nfa and perg.prefilter analyze regexes with.
+
+It's private to the re module, and moved in python 3.11: it used to be the (now deprecated)
+top-level sre_parse and sre_constants modules.
+"""
+
+import sys
+
+if sys.version_info >= (3, 11):
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+else:
+    import sre_constants
+    import sre_parse
+
+__all__ = ['sre_constants', 'sre_parse']
@@ -0,0 +1,223 @@
+"""A persistent, on-disk cache of the patterns each syntax extracts from each file.
+
+Parsing is the expensive part of a perg run, but the string literals in a codebase rarely change
+between runs. This cache stores the list of `Pattern`s that a syntax found in a file, keyed by the
+syntax, the file's path, and a fingerprint of the file (mtime, size and a hash of its contents) and
+of the syntax module itself. Unchanged files skip parsing entirely.
+
+Files that a syntax failed to parse (i.e. raised `PergSyntaxParseError`) are cached as failures, so
+e.g. the bash syntax doesn't re-attempt every python file on every run.
+
+It also remembers what kind of file each one is (see `perg.sniff`), keyed by mtime and size.
+
+The cache lives in the user's cache directory, not in the directory being searched: patterns are
+pickled, and unpickling a cache that came with a checked-out repository could run arbitrary code.
+"""
+
+import importlib.util
+import os
+import pickle
+import time
+from functools import lru_cache
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from perg import Pattern
+from perg import Syntax
+from perg.syntaxes import PergSyntaxParseError
+from perg.syntaxes import open_source
+from perg.sniff import FileKind
+from perg.sniff import sniff_source
+from perg.source import SourceFile
+
+
+def default_cache_dir(directory: str = '.') -> str:
+    """The cache directory for perg runs in `directory`: one per directory, under $XDG_CACHE_HOME/perg
+    (~/.cache/perg by default)."""
+    import hashlib
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    key = hashlib.blake2b(os.fsencode(os.path.abspath(directory)), digest_size=8).hexdigest()
+    return os.path.join(base, 'perg', key)
+
+
+# Filesystem timestamps are coarse, so a file modified twice within the same tick can keep its
+# mtime and size. If a file's mtime is this recent, we don't trust it and compare hashes instead.
+RACY_MTIME_WINDOW_NS = 2 * 10**9
+
+
+@lru_cache(maxsize=None)
+def _module_version(module_name: str) -> str:
+    import hashlib
+
+    # Find the module's source without importing it: a cache hit shouldn't load a tree-sitter grammar.
+    spec = importlib.util.find_spec(module_name)
+    hasher = hashlib.blake2b(digest_size=16)
+    if spec is not None and spec.has_location and spec.origin:
+        with open(spec.origin, 'rb') as f:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+# Besides each syntax module itself, the modules whose code decides which patterns a syntax finds:
+# perg defines the Pattern and Location classes that get pickled, and the rest are shared helpers
+# (e.g. _treesitter decides which nodes are searched for patterns).
+SHARED_MODULES = ('perg', 'perg.common_checkers', 'perg.syntaxes', 'perg.syntaxes._treesitter')
+
+
+def syntax_version(syntax: Syntax) -> str:
+    """A fingerprint of a syntax module's source and of SHARED_MODULES. Editing any of them
+    invalidates the syntax's cached patterns."""
+    return ''.join(_module_version(name) for name in (*SHARED_MODULES, syntax.__name__))
+
+
+class PatternCache:
+    def __init__(self, directory: Optional[str] = None, check_same_thread: bool = True):
+        """Pass check_same_thread=False to allow closing the cache from a thread other than the one
+        that opened it. It still mustn't be used by two threads at once."""
+        # Imported here, like hashlib above, since most runs don't use the cache.
+        import sqlite3
+
+        if directory is None:
+            directory = default_cache_dir()
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, 'patterns.sqlite3'), timeout=60, check_same_thread=check_same_thread)
+        # WAL lets several perg processes (e.g. --jobs workers) read and write the cache at once.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                syntax TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                version TEXT NOT NULL,
+                patterns BLOB,  -- NULL if the syntax couldn't parse this file.
+                PRIMARY KEY (syntax, path)
+            )
+            """
+        )
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_kinds (
+                path TEXT NOT NULL PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                kind TEXT NOT NULL
+            )
+            """
+        )
+        self.db.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_patterns(self, syntax: Syntax, filename: str, source: Optional[SourceFile] = None) -> List[Pattern]:
+        """Return the patterns that `syntax` finds in `filename`, parsing the file only if needed.
+        `source` is the file's shared SourceFile, if the caller has one.
+
+        Raises PergSyntaxParseError if the syntax can't parse this file (now or when cached).
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(filename)
+        version = syntax_version(syntax)
+        if source is None:
+            source = SourceFile(filename)
+
+        row = self.db.execute(
+            "SELECT mtime_ns, size, digest, version, patterns FROM files WHERE syntax = ? AND path = ?",
+            (syntax.__name__, path),
+        ).fetchone()
+
+        digest = None
+        if row is not None:
+            mtime_ns, size, cached_digest, cached_version, blob = row
+            if cached_version == version:
+                fresh = (
+                    (mtime_ns, size) == (stat.st_mtime_ns, stat.st_size)
+                    and time.time_ns() - mtime_ns > RACY_MTIME_WINDOW_NS
+                )
+                if not fresh:
+                    digest = source.digest
+                    fresh = digest == cached_digest
+                    if fresh:
+                        self.db.execute(
+                            "UPDATE files SET mtime_ns = ?, size = ? WHERE syntax = ? AND path = ?",
+                            (stat.st_mtime_ns, stat.st_size, syntax.__name__, path),
+                        )
+
+                if fresh:
+                    if blob is None:
+                        raise PergSyntaxParseError(f"{syntax.__name__} previously failed to parse {filename}")
+                    patterns = self._load(blob)
+                    if patterns is not None:
+                        return patterns
+
+        if digest is None:
+            digest = source.digest
+
+        try:
+            with open_source(syntax, source) as f:
+                patterns = list(syntax.parse(f, filename))
+        except PergSyntaxParseError:
+            self._store(syntax, path, stat, digest, version, None)
+            raise
+
+        self._store(syntax, path, stat, digest, version, patterns)
+        return patterns
+
+    def get_file_kind(self, filename: str, source: Optional[SourceFile] = None) -> Tuple[FileKind, int]:
+        """perg.sniff.sniff_source, but remembered for files whose mtime and size haven't changed."""
+        if source is None:
+            source = SourceFile(filename)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return sniff_source(source)
+        path = os.path.abspath(filename)
+        row = self.db.execute("SELECT mtime_ns, size, kind FROM file_kinds WHERE path = ?", (path,)).fetchone()
+        if (
+            row is not None
+            and row[:2] == (stat.st_mtime_ns, stat.st_size)
+            and time.time_ns() - stat.st_mtime_ns > RACY_MTIME_WINDOW_NS
+        ):
+            try:
+                return FileKind(row[2]), stat.st_size
+            except ValueError:
+                pass  # written by a version of perg with different kinds.
+
+        kind, size = sniff_source(source)
+        self.db.execute(
+            "INSERT OR REPLACE INTO file_kinds (path, mtime_ns, size, kind) VALUES (?, ?, ?, ?)",
+            (path, stat.st_mtime_ns, stat.st_size, kind.value),
+        )
+        return kind, size
+
+    @staticmethod
+    def _load(blob) -> Optional[List[Pattern]]:
+        try:
+            return pickle.loads(blob)
+        except Exception:
+            # e.g. a class that was pickled has since been renamed. Treat this as a cache miss.
+            return None
+
+    def _store(self, syntax, path, stat, digest, version, patterns):
+        blob = None if patterns is None else pickle.dumps(patterns, protocol=pickle.HIGHEST_PROTOCOL)
+        self.db.execute(
+            "INSERT OR REPLACE INTO files (syntax, path, mtime_ns, size, digest, version, patterns) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (syntax.__name__, path, stat.st_mtime_ns, stat.st_size, digest, version, blob),
+        )
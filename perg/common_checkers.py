@@ -1,6 +1,10 @@
 import re
 import fnmatch
+from functools import lru_cache
+from typing import Callable
+from typing import Dict
 from typing import Optional
+from typing import Tuple
 
 from perg import CheckFunction
 from perg import CheckResult
@@ -8,28 +12,68 @@ from perg import CheckResult
 _ALL_COMMON = []
 RE_FLAGS = re.MULTILINE | re.DOTALL
 
+# Checkers are called over and over with the same pattern (the heuristics try hundreds of variants
+# of the text against each one), so compiled patterns are cached. re has its own cache, but it's
+# smaller, and it doesn't remember patterns that failed to compile.
+COMPILE_CACHE_SIZE = 4096
+
 
 def common_checker(check_fn: CheckFunction):
     _ALL_COMMON.append(check_fn)
     return check_fn
 
 
+# Checkers that are equivalent to calling check_match_re_simple with some (regex, flags) derived from
+# the pattern, mapped to the function that derives it. This lets other parts of perg (e.g. the
+# prefilter) analyze the regex rather than treating the checker as a black box.
+_REGEX_EQUIVALENTS: Dict[CheckFunction, Callable[..., Optional[Tuple[str, int]]]] = {}
+
+
+def regex_equivalent(*check_fns: CheckFunction):
+    def decorator(to_regex):
+        for check_fn in check_fns:
+            _REGEX_EQUIVALENTS[check_fn] = to_regex
+        return to_regex
+    return decorator
+
+
+def as_regex(check_fn: CheckFunction, pattern) -> Optional[Tuple[str, int]]:
+    """Return the (regex, flags) that check_fn effectively checks `pattern` as, if known."""
+    to_regex = _REGEX_EQUIVALENTS.get(check_fn)
+    if to_regex is None:
+        return None
+    return to_regex(pattern)
+
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_regex(pattern: str, flags: int = RE_FLAGS) -> Optional[re.Pattern]:
+    """Compile a regex, returning None if it isn't valid."""
+    try:
+        return re.compile(pattern, flags)
+    except re.error:
+        return None
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def glob_to_regex(pattern: str) -> str:
+    return fnmatch.translate(pattern)
+
 
 @common_checker
 def check_match_re_verbose(pattern: str, s: str, partial: int) -> Optional[CheckResult]:
-    return check_match_re_simple(pattern, s, partial=partial, flags=RE_FLAGS | re.VERBOSE)
+    return check_match_re_simple(pattern, s, partial, RE_FLAGS | re.VERBOSE)
 
 
 @common_checker
 def check_match_re_simple(pattern: str, s: str, partial: int, flags=RE_FLAGS) -> Optional[CheckResult]:
-    try:
-        compiled = re.compile(pattern, flags)
-    except re.error:
+    compiled = compile_regex(pattern, flags)
+    if compiled is None:
         return None
 
     if partial >= 0:
         spans = []
-        for match in re.finditer(compiled, s):
+        for match in compiled.finditer(s):
             if len(match.group(0)) >= partial:
                 spans.append(match.span())
 
@@ -38,7 +82,7 @@ def check_match_re_simple(pattern: str, s: str, partial: int, flags=RE_FLAGS) ->
         else:
             return None
     else:
-        maybematch = re.fullmatch(compiled, s)
+        maybematch = compiled.fullmatch(s)
         if maybematch is not None:
             return CheckResult(text=s, spans=(maybematch.span(),))
         else:
@@ -73,9 +117,24 @@ def check_string_match(pattern: str, s: str, partial: int) -> Optional[CheckResu
 
 @common_checker
 def check_shell_glob(pattern: str, s: str, partial: int) -> Optional[CheckResult]:
-    regex = fnmatch.translate(pattern)
+    regex = glob_to_regex(pattern)
     # debug(f"pattern: {pattern}, regex: {regex}")
-    return check_match_re_simple(regex, s, partial=partial)
+    return check_match_re_simple(regex, s, partial, RE_FLAGS)
+
+
+@regex_equivalent(check_match_re_simple)
+def _re_simple_as_regex(pattern: str) -> Tuple[str, int]:
+    return pattern, RE_FLAGS
+
+
+@regex_equivalent(check_match_re_verbose)
+def _re_verbose_as_regex(pattern: str) -> Tuple[str, int]:
+    return pattern, RE_FLAGS | re.VERBOSE
+
+
+@regex_equivalent(check_shell_glob)
+def _shell_glob_as_regex(pattern: str) -> Tuple[str, int]:
+    return glob_to_regex(pattern), RE_FLAGS
 
 
 ALL_COMMON = tuple(_ALL_COMMON)
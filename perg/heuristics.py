@@ -1,11 +1,85 @@
 import math
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any
+from typing import Hashable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from perg import check_result
+from perg import stats
+from perg.common_checkers import as_regex
+from perg.common_checkers import compile_regex
+
+
+SCORING_ENGINES = ('experimental', 'analytical')
+
+
+def build_nfa(regex: str, flags: int):
+    """perg.nfa.build_nfa, imported the first time there's a match to look at, rather than on every
+    run."""
+    from perg import nfa
+
+    return nfa.build_nfa(regex, flags)
+
+
+class ResultCache:
+    """An LRU cache for heuristics that depend only on a match's checker, pattern value, text and
+    partial, which many matches share: the same literal is often found all over a codebase.
+
+    (These can't just be lru_caches, since computing a result needs the match itself.)
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.results: 'OrderedDict[Hashable, Any]' = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+        return result
+
+    def put(self, key: Hashable, result: Any) -> None:
+        self.results[key] = result
+        self.results.move_to_end(key)
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+    def cache_clear(self) -> None:
+        self.results.clear()
+
+
+def match_key(match) -> tuple:
+    """Everything a heuristic's result for match depends on."""
+    return match.check_fn, match.pattern.value, match.text, match.partial
+
+
+RESULT_CACHE_SIZE = 1 << 14
+_replaceable_chars_results = ResultCache(RESULT_CACHE_SIZE)
+# match_key + engine -> (score, None) if we know the score, or (None, minimum) if we only know it's
+# less than minimum.
+_information_results = ResultCache(RESULT_CACHE_SIZE)
+
 
 def pattern_matches_empty(match):
     """This tests a pattern against the empty string. Example patterns that would match this:
         '.*'
         ''
     """
-    return match.check_fn(match.pattern.value, '', partial=-1)
+    if stats.STATS is not None:
+        stats.STATS.count('pattern_matches_empty: checks')
+    return check_result(match.check_fn, match.pattern.value, '', -1)
+
+
+ONE_BYTE_CHARS = tuple(chr(c) for c in range(1, 255) if chr(c) != '\n')
+# The same, as a bitmask over chr(0)..chr(255).
+ONE_BYTE_CHARS_MASK = sum(1 << ord(c) for c in ONE_BYTE_CHARS)
+
+# The verdict only depends on the pattern, not the text, and the same patterns come up over and over
+# (in every match against them, and in common strings like "%s" across a codebase).
+TRIVIALITY_CACHE_SIZE = 1 << 16
 
 
 def pattern_matches_single_char(match):
@@ -15,11 +89,38 @@ def pattern_matches_single_char(match):
         .?
         .+
     """
-    test_strings = [chr(c) for c in range(1, 255) if chr(c) != '\n']
-    return all(match.check_fn(match.pattern.value, ts, partial=-1) for ts in test_strings)
+    if stats.STATS is not None:
+        stats.STATS.count('pattern_matches_single_char: calls')
+    regex = as_regex(match.check_fn, match.pattern.value)
+    if regex is not None:
+        return regex_matches_every_single_char(*regex)
+    return checker_matches_every_single_char(match.check_fn, match.pattern.value)
+
+
+@lru_cache(maxsize=TRIVIALITY_CACHE_SIZE)
+def regex_matches_every_single_char(regex: str, flags: int) -> bool:
+    """pattern_matches_single_char for a checker that's equivalent to check_match_re_simple(regex,
+    flags). Where possible, this reads the answer off the regex's NFA instead of trying each one."""
+    if stats.STATS is not None:
+        stats.STATS.count('pattern_matches_single_char: verdicts computed')
+    nfa = build_nfa(regex, flags)
+    if nfa is not None:
+        return nfa.single_char_mask() & ONE_BYTE_CHARS_MASK == ONE_BYTE_CHARS_MASK
+    compiled = compile_regex(regex, flags)
+    return compiled is not None and all(compiled.fullmatch(ts) for ts in ONE_BYTE_CHARS)
+
+
+@lru_cache(maxsize=TRIVIALITY_CACHE_SIZE)
+def checker_matches_every_single_char(check_fn, value) -> bool:
+    if stats.STATS is not None:
+        stats.STATS.count('pattern_matches_single_char: verdicts computed')
+    # Nearly every pattern that isn't trivial fails on the first character, so this is usually one call.
+    return all(check_fn(value, ts, partial=-1) for ts in ONE_BYTE_CHARS)
 
 
 def too_many_things_deletable(match, max_deletable=-1, min_undeletable=0):
+    if stats.STATS is not None:
+        stats.STATS.count('too_many_things_deletable: calls')
     deletable_indexes = deletable_chars(match)
     deletable = len(deletable_indexes)
     required = len(match.text) - deletable
@@ -46,14 +147,20 @@ def spans_are_equivalent(span1, span2, deletion=False):
         return span1 == span2
 
 
-ONE_BYTE_CHARS = tuple(chr(c) for c in range(1, 255) if chr(c) != '\n')
+def replaceable_chars(match, replacement_candidates=ONE_BYTE_CHARS):
+    key = (match_key(match), replacement_candidates)
+    replaceable_indexes = _replaceable_chars_results.get(key)
+    if replaceable_indexes is None:
+        replaceable_indexes = tuple(_replaceable_chars(match, replacement_candidates))
+        _replaceable_chars_results.put(key, replaceable_indexes)
+    return list(replaceable_indexes)
 
 
-def replaceable_chars(match, replacement_candidates=ONE_BYTE_CHARS):
+def _replaceable_chars(match, replacement_candidates):
     replaceable_indexes = []
     for span in match.result.spans:
         for i in range(span[0], span[1]):
-            for replacement in find_replacement_alphabet_for_position(match, span, i, replacement_candidates):
+            for replacement in replacement_alphabet(match, span, i, replacement_candidates):
                 if match.text[i] == replacement:
                     continue
 
@@ -63,6 +170,38 @@ def replaceable_chars(match, replacement_candidates=ONE_BYTE_CHARS):
     return replaceable_indexes
 
 
+def replacement_alphabet(match, span, i, replacement_candidates):
+    """Yield the candidates that can replace match.text[i] (or delete it, for the candidate '') with
+    the pattern still matching an equivalent span.
+
+    When the checker is equivalent to a regex, this compiles it once and probes every candidate
+    against it directly, rather than going through the checker (and building a CheckResult) for each
+    one. Otherwise it falls back to find_replacement_alphabet_for_position.
+    """
+    regex = as_regex(match.check_fn, match.pattern.value)
+    compiled = compile_regex(*regex) if regex is not None else None
+    if compiled is None:
+        yield from find_replacement_alphabet_for_position(match, span, i, replacement_candidates)
+        return
+
+    prefix = match.text[:i]
+    suffix = match.text[i+1:]
+    if match.partial < 0:
+        # A full match always covers the whole (modified) text, which is always equivalent.
+        fullmatch = compiled.fullmatch
+        for replacement in replacement_candidates:
+            if fullmatch(prefix + replacement + suffix) is not None:
+                yield replacement
+    else:
+        for replacement in replacement_candidates:
+            deletion = replacement == ''
+            for new_match in compiled.finditer(prefix + replacement + suffix):
+                new_span = new_match.span()
+                if new_span[1] - new_span[0] >= match.partial and spans_are_equivalent(new_span, span, deletion):
+                    yield replacement
+                    break
+
+
 def find_replacement_alphabet_for_position(match, span, i, replacement_candidates):
     for replacement in replacement_candidates:
         modified_text = match.text[:i] + replacement + match.text[i+1:]
@@ -74,7 +213,67 @@ def find_replacement_alphabet_for_position(match, span, i, replacement_candidate
             yield replacement
 
 
-def information(match):
+# The candidates that information() tries at each position, as a bitmask over chr(0)..chr(255).
+INFORMATION_CANDIDATES_MASK = sum(1 << c for c in range(1, 256))
+
+
+def analytical_alphabet_sizes(match) -> Optional[List[int]]:
+    """For each character of match.text, count the characters from chr(1) to chr(255) (plus deletion)
+    that could take its place with the pattern still matching, by walking an NFA built from the
+    pattern's regex rather than trying each one.
+
+    Returns None if this can't be done for the match: it's a partial match, its checker isn't known
+    to be equivalent to a regex, or the regex isn't regular (e.g. it has backreferences).
+    """
+    if match.partial >= 0:
+        return None
+    regex = as_regex(match.check_fn, match.pattern.value)
+    if regex is None:
+        return None
+    nfa = build_nfa(*regex)
+    if nfa is None:
+        return None
+    return nfa.alphabet_sizes(match.text, INFORMATION_CANDIDATES_MASK)
+
+
+# Slack for floating-point error when comparing a running upper bound against a minimum score.
+_EPSILON = 1e-9
+
+
+def _span_bits(match) -> int:
+    """The most information(match) could be: 8 bits for each character inside a matched span (when
+    it's the only character that fits there). Characters outside the spans contribute nothing."""
+    return 8 * sum(end - start for start, end in match.result.spans)
+
+
+def information_upper_bound(match) -> float:
+    """An upper bound on information(match), without probing anything.
+
+    For full matches of regular patterns, this is tightened using the pattern's NFA (see
+    NFA.information_bounds), so e.g. "foo .* baz" is bounded by about 64 bits plus a little per
+    character, however long the text is. Otherwise it's _span_bits.
+    """
+    bound = _span_bits(match)
+    if match.partial < 0:
+        nfa_bounds = _nfa_information_bounds(match.check_fn, match.pattern.value)
+        if nfa_bounds is not None:
+            fixed, per_char = nfa_bounds
+            bound = min(bound, fixed + per_char * len(match.text) + _EPSILON)
+    return bound
+
+
+@lru_cache(maxsize=TRIVIALITY_CACHE_SIZE)
+def _nfa_information_bounds(check_fn, value) -> Optional[Tuple[float, float]]:
+    regex = as_regex(check_fn, value)
+    if regex is None:
+        return None
+    nfa = build_nfa(*regex)
+    if nfa is None:
+        return None
+    return nfa.information_bounds(INFORMATION_CANDIDATES_MASK)
+
+
+def information(match, engine='experimental', minimum=None):
     r"""
     From https://en.wikipedia.org/wiki/Entropy_(information_theory):
 
@@ -141,10 +340,48 @@ def information(match):
 
     TODO: lookahead/lookbehinds would be handled incorrectly, as we assume that anything outside of
     the matched span is replaceable.
+
+    With engine='analytical', the alphabet sizes are instead computed exactly (and much faster) by
+    analytical_alphabet_sizes, for the patterns that supports; this gives the same results as the
+    experimental method. Other patterns fall back to the experimental method.
+
+    If `minimum` is given, we give up and return None as soon as the score is certain to be lower
+    than it. Each character's contribution is at most 8 bits, so after scoring some characters we
+    know the most the rest could add.
+
+    Scores (and what we learned from giving up early) are remembered for each checker, pattern
+    value, text and partial, since matches of the same literal in different places score the same.
     """
+    key = (match_key(match), engine)
+    cached = _information_results.get(key)
+    if cached is not None:
+        score, less_than = cached
+        if score is not None:
+            if stats.STATS is not None:
+                stats.STATS.count('information: cache hits')
+            return None if minimum is not None and score < minimum - _EPSILON else score
+        if minimum is not None and minimum >= less_than:
+            if stats.STATS is not None:
+                stats.STATS.count('information: cache hits')
+            return None
+
+    score = _information(match, engine, minimum)
+    _information_results.put(key, (score, None) if score is not None else (None, minimum))
+    return score
+
+
+def _information(match, engine, minimum):
+
+    alphabet_sizes = None
+    if engine == 'analytical':
+        alphabet_sizes = analytical_alphabet_sizes(match)
+    if stats.STATS is not None:
+        stats.STATS.count(f"information: {'analytical' if alphabet_sizes is not None else 'experimental'} calls")
 
     information_bits = 0
     end_of_last_span = 0
+    # What the score would be if every remaining character were worth 8 bits.
+    upper_bound = _span_bits(match)
 
     for span in match.result.spans:
         start, end = span
@@ -154,18 +391,28 @@ def information(match):
         end_of_last_span = end
 
         for i in range(start, end):
-            count = len(
-                list(
-                    find_replacement_alphabet_for_position(
-                        match=match,
-                        span=span,
-                        i=i,
-                        replacement_candidates=[chr(c) for c in range(1, 256)] + [''],
+            if alphabet_sizes is not None:
+                count = alphabet_sizes[i]
+            else:
+                if stats.STATS is not None:
+                    stats.STATS.count('information: characters probed')
+                count = len(
+                    list(
+                        replacement_alphabet(
+                            match=match,
+                            span=span,
+                            i=i,
+                            replacement_candidates=[chr(c) for c in range(1, 256)] + [''],
+                        )
                     )
                 )
-            )
             information_bits += math.log2(count)
 
+            if minimum is not None:
+                upper_bound -= math.log2(count)
+                if upper_bound < minimum - _EPSILON:
+                    return None
+
     information_bits += 8 * (len(match.text) - end_of_last_span)
 
     return len(match.text) * 8 - information_bits
@@ -0,0 +1,396 @@
+"""A small NFA built from python's own regex parse tree, for analyzing regular patterns exactly.
+
+`heuristics.information` experimentally determines, for each character of the text, how many
+replacements (or a deletion) would still match the pattern. For patterns that are truly regular --
+no backreferences, lookarounds, or anchors in the middle -- we can compute the same numbers exactly
+by simulating an NFA: the set of states reachable after reading text[:i], and the set of states from
+which text[i+1:] leads to acceptance. A character c is a valid replacement at i iff some transition
+on c connects the two sets, and deletion is valid iff the sets intersect.
+
+Only full matches are supported; what counts as a match for partial matching depends on the
+leftmost-first semantics of python's regex engine rather than on the language alone.
+"""
+
+import math
+import re
+from functools import cached_property
+from functools import lru_cache
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from perg._sre import sre_constants
+from perg._sre import sre_parse
+
+
+
+# Counted repeats are expanded into copies of the repeated sub-NFA, so e.g. `.{1000}` gets big fast.
+# Past this size we give up and let the caller fall back to something else.
+MAX_STATES = 10000
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r'\d',
+    sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_SPACE: r'\s',
+    sre_constants.CATEGORY_NOT_SPACE: r'\S',
+    sre_constants.CATEGORY_WORD: r'\w',
+    sre_constants.CATEGORY_NOT_WORD: r'\W',
+}
+
+
+class UnsupportedPattern(Exception):
+    pass
+
+
+_ALL_ONE_BYTE = (1 << 256) - 1
+
+
+@lru_cache(maxsize=None)
+def _category_regex(category, ascii: bool) -> 're.Pattern':
+    return re.compile(_CATEGORIES[category], re.ASCII if ascii else 0)
+
+
+@lru_cache(maxsize=None)
+def _category_mask(category, ascii: bool) -> int:
+    regex = _category_regex(category, ascii)
+    return sum(1 << c for c in range(256) if regex.fullmatch(chr(c)))
+
+
+class CharClass:
+    """A set of characters that a single NFA transition accepts."""
+
+    def __init__(self, literals=(), ranges=(), categories=(), negate=False, ascii=False):
+        self.literals = frozenset(literals)
+        self.ranges = tuple(ranges)
+        self.categories = tuple(categories)  # sre CATEGORY_* constants, e.g. for \d
+        self.negate = negate
+        self.ascii = ascii
+
+        # A bitmask of which of the characters chr(0) through chr(255) are in this class.
+        mask = 0
+        for c in self.literals:
+            if c < 256:
+                mask |= 1 << c
+        for lo, hi in self.ranges:
+            if lo < 256:
+                mask |= ((1 << (min(hi, 255) + 1)) - 1) & ~((1 << lo) - 1)
+        for category in self.categories:
+            mask |= _category_mask(category, ascii)
+        if negate:
+            mask ^= _ALL_ONE_BYTE
+        self.mask = mask
+
+    def __contains__(self, ch: str) -> bool:
+        c = ord(ch)
+        if c < 256:
+            return bool((self.mask >> c) & 1)
+        return (
+            c in self.literals
+            or any(lo <= c <= hi for lo, hi in self.ranges)
+            or any(_category_regex(category, self.ascii).fullmatch(ch) for category in self.categories)
+        ) != self.negate
+
+
+class NFA:
+    def __init__(self):
+        self.epsilon: List[List[int]] = []
+        self.edges: List[List[Tuple[CharClass, int]]] = []
+        self.start = self.new_state()
+        self.accept = self.new_state()
+
+    def new_state(self) -> int:
+        if len(self.edges) >= MAX_STATES:
+            raise UnsupportedPattern("too many states")
+        self.epsilon.append([])
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    @cached_property
+    def closures(self) -> List[int]:
+        """For each state, a bitmask of the states reachable from it by epsilon transitions."""
+        return [self._closure(state, self.epsilon) for state in range(len(self.edges))]
+
+    @cached_property
+    def coclosures(self) -> List[int]:
+        """For each state, a bitmask of the states that reach it by epsilon transitions."""
+        reverse: List[List[int]] = [[] for _ in self.edges]
+        for state, targets in enumerate(self.epsilon):
+            for target in targets:
+                reverse[target].append(state)
+        return [self._closure(state, reverse) for state in range(len(self.edges))]
+
+    @staticmethod
+    def _closure(state, graph) -> int:
+        seen = 1 << state
+        stack = [state]
+        while stack:
+            for target in graph[stack.pop()]:
+                if not (seen >> target) & 1:
+                    seen |= 1 << target
+                    stack.append(target)
+        return seen
+
+    def _forward(self, text: str) -> List[int]:
+        """forward[i] is the set of states reachable after reading text[:i]."""
+        closures = self.closures
+        current = closures[self.start]
+        forward = [current]
+        for ch in text:
+            following = 0
+            for state in _bits(current):
+                for charclass, target in self.edges[state]:
+                    if ch in charclass:
+                        following |= closures[target]
+            current = following
+            forward.append(current)
+        return forward
+
+    def _backward(self, text: str) -> List[int]:
+        """backward[i] is the set of states from which reading text[i:] reaches the accept state."""
+        coclosures = self.coclosures
+        current = coclosures[self.accept]
+        backward = [current]
+        for ch in reversed(text):
+            preceding = 0
+            for state, edges in enumerate(self.edges):
+                for charclass, target in edges:
+                    if (current >> target) & 1 and ch in charclass:
+                        preceding |= coclosures[state]
+                        break
+            current = preceding
+            backward.append(current)
+        backward.reverse()
+        return backward
+
+    def single_char_mask(self) -> int:
+        """A bitmask of the characters among chr(0)..chr(255) that this NFA accepts on their own."""
+        closures = self.closures
+        accepted = 0
+        for state in _bits(closures[self.start]):
+            for charclass, target in self.edges[state]:
+                if (closures[target] >> self.accept) & 1:
+                    accepted |= charclass.mask
+        return accepted
+
+    def information_bounds(self, candidates_mask: int) -> Tuple[float, float]:
+        """Bound heuristics.information for full matches of this NFA: a text of n characters that
+        matches scores at most `fixed + per_char * n`.
+
+        Along any accepting path, the character read by a transition could be replaced by any of the
+        candidates (a bitmask over chr(0)..chr(255)) in that transition's class, so it's worth at most
+        8 - log2(that many) bits. Transitions that aren't on a cycle are taken at most once, so `fixed`
+        is the most those can add up to on one path; `per_char` is the most any transition on a cycle
+        is worth.
+        """
+        components = self._components()
+        weights = [
+            [(8 - math.log2(max(1, (charclass.mask & candidates_mask).bit_count())), target) for charclass, target in edges]
+            for edges in self.edges
+        ]
+
+        per_char = 0.0
+        for state, edges in enumerate(weights):
+            for weight, target in edges:
+                if components[state] == components[target]:
+                    per_char = max(per_char, weight)
+
+        # The most that transitions off cycles can add between each component and the accept state.
+        # Components are numbered in reverse topological order, so each one's successors come first.
+        members: List[List[int]] = [[] for _ in range(max(components) + 1)]
+        for state, component in enumerate(components):
+            members[component].append(state)
+        best = [-math.inf] * len(members)
+        best[components[self.accept]] = 0.0
+        for component, states in enumerate(members):
+            for state in states:
+                for weight, target in [*weights[state], *((0.0, target) for target in self.epsilon[state])]:
+                    if components[target] != component:
+                        best[component] = max(best[component], weight + best[components[target]])
+        return best[components[self.start]], per_char
+
+    def _components(self) -> List[int]:
+        """The strongly connected component of each state (counting both kinds of transition),
+        numbered in reverse topological order. Tarjan's algorithm, without recursion."""
+        successors = [[*targets, *(target for _, target in edges)] for targets, edges in zip(self.epsilon, self.edges)]
+        index = [-1] * len(successors)  # -1 until visited.
+        lowlink = [0] * len(successors)
+        components = [-1] * len(successors)
+        stack: List[int] = []
+        count = 0
+        component = 0
+        for root in range(len(successors)):
+            if index[root] != -1:
+                continue
+            work = [(root, 0)]
+            while work:
+                state, i = work.pop()
+                if i == 0:
+                    index[state] = lowlink[state] = count
+                    count += 1
+                    stack.append(state)
+                if i < len(successors[state]):
+                    work.append((state, i + 1))
+                    target = successors[state][i]
+                    if index[target] == -1:
+                        work.append((target, 0))
+                    elif components[target] == -1:
+                        lowlink[state] = min(lowlink[state], index[target])
+                    continue
+                if lowlink[state] == index[state]:
+                    while True:
+                        member = stack.pop()
+                        components[member] = component
+                        if member == state:
+                            break
+                    component += 1
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[state])
+        return components
+
+    def alphabet_sizes(self, text: str, candidates_mask: int) -> Optional[List[int]]:
+        """For each position in text, count the candidate characters (given as a bitmask over
+        chr(0)..chr(255)) that could replace the character there, plus 1 if it could be deleted,
+        with the text still fully matching. Returns None if the text doesn't match at all."""
+        forward = self._forward(text)
+        backward = self._backward(text)
+        if not forward[-1] & backward[-1]:
+            return None
+
+        sizes = []
+        for i in range(len(text)):
+            after = backward[i + 1]
+            accepted = 0
+            for state in _bits(forward[i]):
+                for charclass, target in self.edges[state]:
+                    if (after >> target) & 1:
+                        accepted |= charclass.mask
+            size = (accepted & candidates_mask).bit_count()
+            if forward[i] & after:
+                size += 1
+            sizes.append(size)
+        return sizes
+
+
+def _bits(mask: int):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class _Builder:
+    def __init__(self, nfa: NFA, ascii: bool):
+        self.nfa = nfa
+        self.ascii = ascii
+
+    def category(self, category):
+        if category not in _CATEGORIES:
+            raise UnsupportedPattern(f"category {category}")
+        return category
+
+    def charclass(self, op, av, dotall: bool) -> CharClass:
+        if op is sre_constants.LITERAL:
+            return CharClass(literals=(av,))
+        elif op is sre_constants.NOT_LITERAL:
+            return CharClass(literals=(av,), negate=True)
+        elif op is sre_constants.ANY:
+            return CharClass(negate=True) if dotall else CharClass(literals=(ord('\n'),), negate=True)
+        elif op is sre_constants.IN:
+            literals, ranges, categories, negate = [], [], [], False
+            for item_op, item_av in av:
+                if item_op is sre_constants.NEGATE:
+                    negate = True
+                elif item_op is sre_constants.LITERAL:
+                    literals.append(item_av)
+                elif item_op is sre_constants.RANGE:
+                    ranges.append(item_av)
+                elif item_op is sre_constants.CATEGORY:
+                    categories.append(self.category(item_av))
+                else:
+                    raise UnsupportedPattern(f"{item_op} in character class")
+            return CharClass(literals, ranges, categories, negate, self.ascii)
+        raise UnsupportedPattern(str(op))
+
+    def sequence(self, items, start: int, dotall: bool) -> int:
+        """Add transitions for `items` starting at state `start`; return the state they end at."""
+        for op, av in items:
+            start = self.item(op, av, start, dotall)
+        return start
+
+    def item(self, op, av, start: int, dotall: bool) -> int:
+        nfa = self.nfa
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+            end = nfa.new_state()
+            nfa.edges[start].append((self.charclass(op, av, dotall), end))
+            return end
+        elif op is sre_constants.BRANCH:
+            _, alternatives = av
+            end = nfa.new_state()
+            for alternative in alternatives:
+                alternative_start = nfa.new_state()
+                nfa.epsilon[start].append(alternative_start)
+                nfa.epsilon[self.sequence(alternative, alternative_start, dotall)].append(end)
+            return end
+        elif op is sre_constants.SUBPATTERN:
+            _group, add_flags, del_flags, sub = av
+            if (add_flags | del_flags) & (re.IGNORECASE | re.ASCII | re.LOCALE):
+                raise UnsupportedPattern("scoped flags")
+            if add_flags & re.DOTALL:
+                dotall = True
+            if del_flags & re.DOTALL:
+                dotall = False
+            return self.sequence(sub, start, dotall)
+        elif op in _REPEATS:
+            min_repeat, max_repeat, sub = av
+            for _ in range(min_repeat):
+                start = self.sequence(sub, start, dotall)
+            if max_repeat == sre_constants.MAXREPEAT:
+                loop = nfa.new_state()
+                nfa.epsilon[start].append(loop)
+                nfa.epsilon[self.sequence(sub, loop, dotall)].append(loop)
+                return loop
+            end = nfa.new_state()
+            nfa.epsilon[start].append(end)
+            for _ in range(max_repeat - min_repeat):
+                start = self.sequence(sub, start, dotall)
+                nfa.epsilon[start].append(end)
+            return end
+        raise UnsupportedPattern(str(op))
+
+
+_LEADING_ANCHORS = (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING)
+_TRAILING_ANCHORS = (sre_constants.AT_END, sre_constants.AT_END_STRING)
+
+
+@lru_cache(maxsize=4096)
+def build_nfa(regex: str, flags: int) -> Optional[NFA]:
+    """Build an NFA accepting exactly the strings that re.fullmatch(regex, s, flags) matches, or
+    return None if the regex isn't something we can represent."""
+    try:
+        parsed = sre_parse.parse(regex, flags)
+    except Exception:
+        return None
+
+    global_flags = parsed.state.flags
+    if global_flags & (re.IGNORECASE | re.LOCALE):
+        return None
+
+    items = list(parsed.data)
+    # Since we're only concerned with full matches, anchors at the very beginning or end are
+    # always satisfied. Anchors anywhere else depend on context, which we don't model.
+    while items and items[0][0] is sre_constants.AT and items[0][1] in _LEADING_ANCHORS:
+        items.pop(0)
+    while items and items[-1][0] is sre_constants.AT and items[-1][1] in _TRAILING_ANCHORS:
+        items.pop()
+
+    nfa = NFA()
+    builder = _Builder(nfa, ascii=bool(global_flags & re.ASCII))
+    try:
+        end = builder.sequence(items, nfa.start, dotall=bool(global_flags & re.DOTALL))
+    except (UnsupportedPattern, RecursionError):
+        return None
+    nfa.epsilon[end].append(nfa.accept)
+    return nfa
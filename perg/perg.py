@@ -1,29 +1,49 @@
 import argparse
+import contextlib
+import json
 import importlib
-import os.path
+import itertools
 import os
-import pdb
 import pkgutil
 import sys
+import threading
 import traceback
 import warnings
 
+from collections import deque
+from typing import Callable
 from typing import Collection
 from typing import List
 from typing import Iterator
 from typing import Tuple
 from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import Optional
+from typing import Sequence
+from typing import TypeVar
 
 import perg.syntaxes
 from perg.syntaxes import Relevance
 from perg.syntaxes import PergSyntaxParseError
+from perg.syntaxes import open_source
+from perg.cache import PatternCache
+from perg.sniff import FileKind
+from perg.sniff import sniff_source
+from perg.source import SourceFile
+from perg.walk import DEFAULT_THREADS as DEFAULT_WALK_THREADS
+from perg.walk import Walker
 from perg import heuristics
+from perg import prefilter
+from perg import stats
 from perg import Match
 from perg import CheckResult
+from perg import checker_name
 from perg import Location
 from perg import debug
 from perg import Syntax
 from perg import NoMatchError
+from perg import Pattern
 from perg.color import BRIGHT_YELLOW
 from perg.color import RESET
 from perg.color import BRIGHT
@@ -34,28 +54,96 @@ from perg.color import BRIGHT_PURPLE
 import perg
 
 
-def find_files(paths, ignore_dot=True):
-    """Find all the filenames described by self.paths, open them, and yield them and the syntax associated with them"""
-    #TODO recursive (-r)
-    for path in paths:
-        if os.path.isdir(path):
-            for root, subdirs, files in os.walk(path):
-                if ignore_dot:
-                    for subdir in subdirs:
-                        if subdir.startswith('.'):
-                            subdirs.remove(subdir)
-                for file in files:
-                    if not (ignore_dot and file.startswith('.')):
-                        newpath = os.path.join(root, file)
-                        yield newpath
-        else:
-            yield path
-
-
-def parse_args():
+T = TypeVar('T')
+R = TypeVar('R')
+
+# How many files to send to a --jobs worker at a time.
+JOBS_CHUNKSIZE = 16
+
+# With --jobs, how many chunks per worker to have scanned (or scanning) ahead of the one being output.
+JOBS_AHEAD = 2
+
+# With --parse-threads, how many files per thread to have parsed (or parsing) ahead of the file whose
+# patterns are being checked.
+PARSE_AHEAD = 4
+
+DEFAULT_MAX_GUESS_SIZE = 1 << 20
+
+
+def find_files(paths, walker: Optional[Walker] = None) -> Iterator[str]:
+    """Find all the files to search under paths. (See perg.walk for what's skipped.)"""
+    if walker is None:
+        walker = Walker()
+    return walker.walk(paths)
+
+
+def make_walker(args) -> Walker:
+    return Walker(
+        use_ignore_files=args.ignore_files,
+        include=args.include,
+        exclude=args.exclude,
+        max_file_size=args.max_file_size,
+        threads=args.walk_threads,
+    )
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
-    parser.add_argument('text', type=str, help="The text to match patterns against.")
-    parser.add_argument('paths', nargs='*', type=str, default=['.'])
+    parser.add_argument('text', type=str, nargs='?', help="The text to match patterns against. Not used with --queries-from.")
+    parser.add_argument('paths', nargs='*', type=str)
+    parser.add_argument(
+        '--queries-from',
+        type=str,
+        default=None,
+        metavar='FILE',
+        help="Match patterns against each line of FILE (or stdin, for -) instead of a single text, parsing each source"
+             " file only once. Results are printed as JSON lines, tagged with the query they match.",
+    )
+    parser.add_argument(
+        '--ignore-files',
+        action=argparse.BooleanOptionalAction,
+        help="Skip files and directories matched by .gitignore and .ignore files.",
+        default=True,
+    )
+    parser.add_argument(
+        '--include',
+        type=str,
+        action='append',
+        default=[],
+        metavar='GLOB',
+        help="Only search files whose name or path (relative to the path being searched) matches GLOB. Can be"
+             " given more than once.",
+    )
+    parser.add_argument(
+        '--exclude',
+        type=str,
+        action='append',
+        default=[],
+        metavar='GLOB',
+        help="Don't search files or directories whose name or path (relative to the path being searched) matches"
+             " GLOB. Can be given more than once.",
+    )
+    parser.add_argument(
+        '--max-file-size',
+        type=int,
+        default=None,
+        metavar='BYTES',
+        help="Skip files bigger than this.",
+    )
+    parser.add_argument(
+        '--max-guess-size',
+        type=int,
+        default=DEFAULT_MAX_GUESS_SIZE,
+        metavar='BYTES',
+        help="Only try syntaxes that might be relevant to a file (rather than matching its extension) on files up to"
+             " this big. Big files with unrecognized extensions are usually data, or minified code.",
+    )
+    parser.add_argument(
+        '--walk-threads',
+        type=int,
+        default=DEFAULT_WALK_THREADS,
+        help="How many threads to list directories with.",
+    )
     parser.add_argument(
         '--ignore-empty-match',
         action=argparse.BooleanOptionalAction,
@@ -171,25 +259,137 @@ def parse_args():
         default=50.0,
         help="Only show matches with a score that's at least this percent of the best-scoring match.",
     )
-
-    args = parser.parse_args()
+    parser.add_argument(
+        '--min-score',
+        type=float,
+        default=None,
+        help="Only show matches with at least this score.",
+    )
+    parser.add_argument(
+        '--stream',
+        action=argparse.BooleanOptionalAction,
+        help="Print matches as soon as each file is scanned, rather than after scanning every file. --pct-of-best-score"
+             " doesn't apply, so this requires --no-score-by-information or --min-score.",
+        default=False,
+    )
+    parser.add_argument(
+        '--scoring-engine',
+        choices=heuristics.SCORING_ENGINES,
+        default='experimental',
+        help="How to compute information scores. 'analytical' computes them exactly from the pattern's regex where"
+             " possible, which is much faster, and falls back to 'experimental' for other patterns.",
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help="Scan files in this many worker processes. 0 means one per CPU.",
+    )
+    parser.add_argument(
+        '--parse-threads',
+        type=int,
+        default=1,
+        help="Read and parse files on this many threads, while the main thread checks the patterns found so far."
+             " Unlike --jobs, nothing needs pickling.",
+    )
+    parser.add_argument(
+        '--stats',
+        action=argparse.BooleanOptionalAction,
+        help="When done, print how much time was spent in each stage of the search (and each syntax), and how many"
+             " times the checkers and heuristics were run, to stderr.",
+        default=False,
+    )
+    parser.add_argument(
+        '--stats-top',
+        type=int,
+        default=0,
+        metavar='N',
+        help="With --stats, also show the N slowest files and patterns. Implies --stats.",
+    )
+    parser.add_argument(
+        '--cache',
+        action=argparse.BooleanOptionalAction,
+        help="Cache the patterns found in each file on disk, so unchanged files don't need to be parsed again.",
+        default=False,
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=None,
+        help="Where to store the pattern cache when --cache is enabled. Defaults to a directory for the current"
+             " directory under $XDG_CACHE_HOME/perg (~/.cache/perg).",
+    )
+    # The texts to match, if they come from somewhere other than the text argument.
+    parser.set_defaults(texts=None)
+    return parser
+
+
+def parse_args(argv: Optional[Sequence[str]] = None, parser: Optional[argparse.ArgumentParser] = None):
+    if parser is None:
+        parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.queries_from is not None:
+        args.texts = read_queries(args.queries_from)
+    if args.texts is None:
+        if args.text is None:
+            parser.error("the following arguments are required: text")
+        args.texts = [args.text]
+    elif args.text is not None:
+        # There's no text argument, so the first positional argument is really a path.
+        args.paths.insert(0, args.text)
+        args.text = None
+    if not args.paths:
+        args.paths = ['.']
+
+    if args.stream and args.score_by_information and args.min_score is None:
+        parser.error("--stream needs a fixed score threshold: pass --min-score or --no-score-by-information")
+    if args.jobs < 0:
+        parser.error("--jobs must be at least 0")
+    if args.jobs != 1 and args.debug_errors:
+        parser.error("--debug-errors can't be used with --jobs, since errors happen in worker processes")
+    if args.parse_threads < 1:
+        parser.error("--parse-threads must be at least 1")
+    if args.parse_threads > 1 and args.jobs != 1:
+        parser.error("--parse-threads can't be used with --jobs")
+    if args.max_guess_size < 0:
+        parser.error("--max-guess-size must be at least 0")
+    if args.walk_threads < 1:
+        parser.error("--walk-threads must be at least 1")
+    if args.stats_top < 0:
+        parser.error("--stats-top must be at least 0")
+    if args.stats_top:
+        args.stats = True
     # if args.show_highlighted_partial_match is None:
     #     args.show_highlighted_partial_match = args.partial
 
     if args.debug:
         perg.DEBUG = True
+    if args.stats:
+        stats.STATS = stats.Stats(args.stats_top)
     return args
 
 
+def read_queries(filename: str) -> List[str]:
+    if filename == '-':
+        lines = list(sys.stdin)
+    else:
+        with open(filename) as f:
+            lines = list(f)
+    return [query for query in (line.rstrip('\r\n') for line in lines) if query]
+
+
 def find_syntaxes(syntax_allowlist=()):
     syntaxes = []
     found_syntax_names = set()
     syntax_allowlist = set(syntax_allowlist)
     for _, name, _ in pkgutil.iter_modules(perg.syntaxes.__path__, 'perg.syntaxes.'):
         shortname = name.removeprefix('perg.syntaxes.')
+        if shortname.startswith('_'):
+            continue  # helpers shared between syntaxes, not syntaxes themselves.
         found_syntax_names.add(shortname)
         if shortname in syntax_allowlist or not syntax_allowlist:
-            syntaxes.append(importlib.import_module(name))
+            # Syntaxes in the registry are imported when a file first needs parsing with them.
+            syntaxes.append(perg.syntaxes.SYNTAXES.get(shortname) or importlib.import_module(name))
 
     if syntax_allowlist:
         unfound_syntaxes = syntax_allowlist - found_syntax_names
@@ -211,7 +411,7 @@ def print_match(
 
     for (score, result), matches2 in matches_by_score_and_result.items():
         text = result.text
-        checker_names = [match.check_fn.__name__ for match in matches2]
+        checker_names = [checker_name(match.check_fn) for match in matches2]
         if args.print_checker_names:
             print(f"{BRIGHT_PURPLE}({', '.join(checker_names)}):{RESET} ", end='')
 
@@ -262,18 +462,29 @@ def passes_heuristics_first_pass(match, args):
     return True
 
 
-def run_syntax_on_file(syntax: Syntax, filename: str, text: str, partial: bool) -> Iterator[Match]:
-    debug(f"trying {syntax} on {filename}")
-    with open(filename) as f:
-        for pattern in syntax.parse(f, filename):
-            debug(pattern)
-            for check_fn in pattern.check_fns:
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    try:
-                        yield Match(check_fn, pattern, text, partial)
-                    except NoMatchError:
-                        pass
+def parse_file(syntax: Syntax, source: SourceFile, cache: Optional[PatternCache] = None) -> Iterator[Pattern]:
+    if cache is not None:
+        yield from cache.get_patterns(syntax, source.filename, source)
+    else:
+        with open_source(syntax, source) as f:
+            yield from syntax.parse(f, source.filename)
+
+
+def match_pattern(pattern: Pattern, text: str, partial: bool) -> Iterator[Match]:
+    """Yield a Match for each of the pattern's checkers that matches the text."""
+    for check_fn in pattern.check_fns:
+        if not prefilter.may_match(check_fn, pattern.value, text):
+            if stats.STATS is not None:
+                stats.STATS.count('checkers skipped by the prefilter')
+            continue
+        if stats.STATS is not None:
+            stats.STATS.count('checker calls')
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            try:
+                yield Match(check_fn, pattern, text, partial)
+            except NoMatchError:
+                pass
 
 
 def group_syntaxes_by_relevance(all_syntaxes, filename):
@@ -289,64 +500,317 @@ def group_syntaxes_by_relevance(all_syntaxes, filename):
     return syntax_scores
 
 
-def main() -> None:
-    args = parse_args()
-
-    all_syntaxes = list(find_syntaxes(args.syntax_allowlist))
-    matches = set()
-
-    for filename in find_files(args.paths):
-        syntax_relevances = group_syntaxes_by_relevance(all_syntaxes, filename)
-        debug(syntax_relevances)
-
-        successful_parse = False
-        for relevance in [Relevance.YES, Relevance.MAYBE]:
-            if syntaxes := syntax_relevances[relevance]:
-                for syntax in syntaxes:
-                    try:
-                        for match in run_syntax_on_file(syntax, filename, args.text, args.partial):
-                            if passes_heuristics_first_pass(match, args):
-                                matches.add(match)
+@contextlib.contextmanager
+def reporting_syntax_errors(syntax: Syntax, filename: str, args) -> Generator[None, None, None]:
+    """Report (and by default, swallow) unexpected errors from running a syntax or its checkers on a file."""
+    try:
+        yield
+    except PergSyntaxParseError:
+        raise
+    except Exception:
+        if args.print_errors:
+            print(f"syntax {syntax} errored on {filename}:")
+            traceback.print_exc()
+        if args.debug_errors:
+            import pdb  # not imported up front, since it's slow to import and rarely needed.
+
+            extype, value, tb = sys.exc_info()
+            traceback.print_exc()
+            pdb.post_mortem(tb)
+        if args.raise_errors:
+            raise
+
+
+def parse_file_patterns(
+    filename: str,
+    all_syntaxes,
+    args,
+    cache: Optional[PatternCache] = None,
+) -> List[Tuple[Syntax, List[Pattern]]]:
+    """Run the relevant syntaxes on a file, returning the patterns that each of them found.
+
+    The file is read once, into a SourceFile that all the syntaxes share.
+    """
+    syntax_patterns = []
+    source = SourceFile(filename)
+    kind, size = cache.get_file_kind(filename, source) if cache is not None else sniff_source(source)
+    if kind is FileKind.BINARY:
+        debug(f"skipping binary file {filename}")
+        if stats.STATS is not None:
+            stats.STATS.count('files skipped as binary')
+        return syntax_patterns
+
+    syntax_relevances = group_syntaxes_by_relevance(all_syntaxes, filename)
+    if syntax_relevances[Relevance.MAYBE] and (kind is not FileKind.TEXT or size > args.max_guess_size):
+        debug(f"not guessing syntaxes for {filename}: it's {kind.value}, and {size} bytes")
+        if stats.STATS is not None:
+            stats.STATS.count('files not worth guessing syntaxes for')
+        syntax_relevances[Relevance.MAYBE] = []
+    debug(syntax_relevances)
+
+    run_stats = stats.STATS
+    successful_parse = False
+    for relevance in [Relevance.YES, Relevance.MAYBE]:
+        if syntaxes := syntax_relevances[relevance]:
+            for syntax in syntaxes:
+                debug(f"trying {syntax} on {filename}")
+                patterns: List[Pattern] = []
+                start = stats.clock()
+                try:
+                    with reporting_syntax_errors(syntax, filename, args):
+                        for pattern in parse_file(syntax, source, cache):
+                            debug(pattern)
+                            patterns.append(pattern)
                         successful_parse = True
-                    except PergSyntaxParseError:
-                        if relevance == Relevance.YES:
-                            # if we think the syntax is definitely relevant, we should raise an error if we can't parse.
-                            raise
-                        else:
-                            pass
-                    except Exception:
-                        if args.print_errors:
-                            print(f"syntax {syntax} errored on {filename}:")
-                            traceback.print_exc()
-                        if args.debug_errors:
-                            extype, value, tb = sys.exc_info()
-                            traceback.print_exc()
-                            pdb.post_mortem(tb)
-                        if args.raise_errors:
-                            raise
-                break  # if we have any YES syntaxes, don't run the MAYBEs.
-        if not successful_parse:
-            debug(
-                f"Couldn't parse file {filename} with syntax{'es' if len(syntaxes) > 1 else ''} {', '.join(s.__name__ for s in syntaxes)}",
-            )
-
-    if args.score_by_information:
-        match_score_fn = heuristics.information
+                except PergSyntaxParseError:
+                    if run_stats is not None:
+                        run_stats.count(f'parse errors from {syntax.__name__}')
+                    if relevance == Relevance.YES:
+                        # if we think the syntax is definitely relevant, we should raise an error if we can't parse.
+                        raise
+                finally:
+                    if run_stats is not None:
+                        run_stats.add('parse', start, items=len(patterns), syntax=syntax.__name__)
+                syntax_patterns.append((syntax, patterns))
+            break  # if we have any YES syntaxes, don't run the MAYBEs.
+    if not successful_parse:
+        debug(
+            f"Couldn't parse file {filename} with syntax{'es' if len(syntaxes) > 1 else ''} {', '.join(s.__name__ for s in syntaxes)}",
+        )
+    return syntax_patterns
+
+
+def match_file_patterns(
+    filename: str,
+    syntax_patterns: Iterable[Tuple[Syntax, Iterable[Pattern]]],
+    texts: Sequence[str],
+    args,
+) -> List[Match]:
+    """Match a file's patterns against each of the texts, returning the matches that pass the first-pass heuristics."""
+    if stats.STATS is not None:
+        return _match_file_patterns_with_stats(filename, syntax_patterns, texts, args, stats.STATS)
+    matches = []
+    for syntax, patterns in syntax_patterns:
+        with reporting_syntax_errors(syntax, filename, args):
+            for pattern in patterns:
+                for text in texts:
+                    for match in match_pattern(pattern, text, args.partial):
+                        if passes_heuristics_first_pass(match, args):
+                            matches.append(match)
+    return matches
+
+
+def _match_file_patterns_with_stats(filename, syntax_patterns, texts, args, run_stats: stats.Stats) -> List[Match]:
+    """match_file_patterns, timing the checkers and the first-pass heuristics separately."""
+    matches = []
+    for syntax, patterns in syntax_patterns:
+        with reporting_syntax_errors(syntax, filename, args):
+            for pattern in patterns:
+                start = stats.clock()
+                pattern_matches = [match for text in texts for match in match_pattern(pattern, text, args.partial)]
+                checked = run_stats.add('check', start, items=len(pattern_matches))
+                kept = [match for match in pattern_matches if passes_heuristics_first_pass(match, args)]
+                run_stats.add('first_pass', checked, items=len(kept))
+                run_stats.add_pattern(pattern, start)
+                matches.extend(kept)
+    return matches
+
+
+def scan_file(filename: str, all_syntaxes, args, cache: Optional[PatternCache] = None) -> List[Match]:
+    """Run the relevant syntaxes on a file, returning the matches that pass the first-pass heuristics."""
+    start = stats.clock()
+    syntax_patterns = parse_file_patterns(filename, all_syntaxes, args, cache)
+    matches = match_file_patterns(filename, syntax_patterns, args.texts, args)
+    if stats.STATS is not None:
+        stats.STATS.add_file(filename, start)
+    return matches
+
+
+# Per-process state for --jobs workers; set up once by _init_worker rather than pickled for every file.
+_worker_state = None
+
+
+def _init_worker(args):
+    global _worker_state
+    perg.DEBUG = args.debug
+    cache = PatternCache(args.cache_dir) if args.cache else None
+    _worker_state = (find_syntaxes(args.syntax_allowlist), args, cache)
+
+
+def _scan_files_in_worker(filenames: List[str]) -> Tuple[List[List[Match]], Optional[stats.Stats]]:
+    """Scan some files, returning each one's matches and, with --stats, the stats for scanning them."""
+    assert _worker_state is not None, "_init_worker hasn't run in this process"
+    all_syntaxes, args, cache = _worker_state
+    if args.stats:
+        stats.STATS = stats.Stats(args.stats_top)
+    try:
+        matches = [scan_file(filename, all_syntaxes, args, cache) for filename in filenames]
+    finally:
+        if cache is not None:
+            cache.commit()
+    run_stats = stats.STATS
+    if run_stats is None:
+        return matches, None
+    run_stats.prune()
+    return matches, run_stats
+
+
+def _chunks(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _map_ahead(executor, fn: Callable[[T], R], items: Iterable[T], ahead: int) -> Iterator[Tuple[T, R]]:
+    """Yield (item, fn(item)) for each item, in order, running fn on the executor. Unlike
+    executor.map, this only takes items from `items` as needed to keep `ahead` of them submitted, so
+    results come out while a slow iterable (like a walk) is still going, and memory stays bounded."""
+    pending: deque = deque()  # of (item, future)
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= ahead:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def parse_files_in_threads(
+    filenames: Iterable[str],
+    all_syntaxes,
+    args,
+) -> Iterator[Tuple[str, List[Tuple[Syntax, List[Pattern]]]]]:
+    """Yield each file's patterns (as parse_file_patterns does), in order, parsing up to
+    --parse-threads files at once."""
+    import concurrent.futures
+
+    # sqlite connections can't be shared between threads, so each thread opens its own.
+    local = threading.local()
+    caches = []
+
+    def parse(filename: str) -> List[Tuple[Syntax, List[Pattern]]]:
+        start = stats.clock()
+        cache = None
+        if args.cache:
+            cache = getattr(local, 'cache', None)
+            if cache is None:
+                cache = local.cache = PatternCache(args.cache_dir, check_same_thread=False)
+                caches.append(cache)
+        try:
+            syntax_patterns = parse_file_patterns(filename, all_syntaxes, args, cache)
+        finally:
+            if cache is not None:
+                cache.commit()  # so as not to hold the database's write lock, which the other threads need.
+        if stats.STATS is not None:
+            stats.STATS.add_file(filename, start)
+        return syntax_patterns
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.parse_threads)
+    try:
+        yield from _map_ahead(executor, parse, filenames, args.parse_threads * PARSE_AHEAD)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        for cache in caches:
+            cache.close()
+
+
+def scan_files(filenames: Iterable[str], args) -> Iterator[List[Match]]:
+    """Yield the matches for each file, fanning the files out to a process pool if --jobs is given,
+    or parsing them on a thread pool if --parse-threads is."""
+    # Look up the syntaxes here even with --jobs, so that a bad --syntax-allowlist fails early.
+    all_syntaxes = list(find_syntaxes(args.syntax_allowlist))
+    if stats.STATS is not None:
+        filenames = stats.STATS.timed_iter('walk', filenames)
+    if args.parse_threads > 1:
+        for filename, syntax_patterns in parse_files_in_threads(filenames, all_syntaxes, args):
+            start = stats.clock()
+            matches = match_file_patterns(filename, syntax_patterns, args.texts, args)
+            if stats.STATS is not None:
+                stats.STATS.add_file(filename, start)
+            yield matches
+    elif args.jobs == 1:
+        cache = PatternCache(args.cache_dir) if args.cache else None
+        try:
+            for filename in filenames:
+                yield scan_file(filename, all_syntaxes, args, cache)
+        finally:
+            if cache is not None:
+                cache.close()
     else:
-        match_score_fn = lambda x: 1  # noqa: E731
-
-    scored_matches = sorted(
-        ((match_score_fn(match), match) for match in matches),
-        reverse=True,
-    )
-    if scored_matches:
+        import concurrent.futures
+
+        jobs = args.jobs or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(args,),
+        ) as executor:
+            chunks = _chunks(filenames, JOBS_CHUNKSIZE)
+            for _, (chunk_matches, chunk_stats) in _map_ahead(executor, _scan_files_in_worker, chunks, jobs * JOBS_AHEAD):
+                if chunk_stats is not None and stats.STATS is not None:
+                    stats.STATS.merge(chunk_stats)
+                yield from chunk_matches
+
+
+def score_matches(matches: Iterable[Match], args, relative: bool = True) -> List[Tuple[float, Match]]:
+    """Score matches, returning those scoring at least --min-score and, if `relative`, within
+    --pct-of-best-score of the best. Best first. (With --no-score-by-information, every score is 1.)"""
+    pct_of_best_score = args.pct_of_best_score if relative else None
+    run_stats = stats.STATS
+    stage_start = stats.clock()
+
+    scored_matches: List[Tuple[float, Match]]
+    if not args.score_by_information:
+        scored_matches = sorted(((1, match) for match in matches), reverse=True)
+    else:
+        # Score the most promising matches first, so we know the best score early and can stop
+        # scoring a match once it can no longer reach the threshold. (This relies on the threshold
+        # only going up as better scores are found, so it doesn't work for a negative percentage.)
+        early_exit = pct_of_best_score is not None and pct_of_best_score >= 0
+        best_score = None
+        scored_matches = []
+        for upper_bound, match in sorted(
+            ((heuristics.information_upper_bound(match), match) for match in matches),
+            reverse=True,
+        ):
+            minimum = args.min_score
+            if early_exit and best_score is not None:
+                relative_minimum = pct_of_best_score * best_score / 100
+                if minimum is None or relative_minimum > minimum:
+                    minimum = relative_minimum
+            if minimum is not None and upper_bound < minimum:
+                break  # nothing after this can do any better.
+
+            if run_stats is None:
+                score = heuristics.information(match, engine=args.scoring_engine, minimum=minimum)
+            else:
+                start = stats.clock()
+                score = heuristics.information(match, engine=args.scoring_engine, minimum=minimum)
+                run_stats.add_pattern(match.pattern, start)
+            if score is None:
+                continue
+            scored_matches.append((score, match))
+            if best_score is None or score > best_score:
+                best_score = score
+        scored_matches.sort(reverse=True)
+
+    if args.min_score is not None:
+        scored_matches = [(score, match) for score, match in scored_matches if score >= args.min_score]
+
+    if pct_of_best_score is not None and scored_matches:
         best_score, _ = scored_matches[0]
-        threshold = args.pct_of_best_score * best_score / 100
+        threshold = pct_of_best_score * best_score / 100
         for i, (score, match) in enumerate(scored_matches):
             if score < threshold:
                 scored_matches = scored_matches[:i]
                 break
+    if run_stats is not None:
+        run_stats.add('score', stage_start, items=len(scored_matches))
+    return scored_matches
 
+
+def print_scored_matches(scored_matches: Iterable[Tuple[float, Match]], args) -> None:
     scored_matches_by_location: Dict[Location, List[Tuple[float, Match]]] = {}
     for score, match in scored_matches:
         scored_matches_by_location.setdefault(match.pattern.location, []).append((score, match))
@@ -354,5 +818,91 @@ def main() -> None:
     for location, scored_matches_for_location in scored_matches_by_location.items():
         print_match(location, scored_matches_for_location, args)
 
+
+def scored_matches_to_records(scored_matches: Iterable[Tuple[float, Match]]) -> List[dict]:
+    """Convert scored matches to JSON-friendly dicts, one per location."""
+    records: Dict[Tuple[str, Location], dict] = {}
+    for score, match in scored_matches:
+        location = match.pattern.location
+        record = records.setdefault((match.text, location), {
+            'query': match.text,
+            'filename': location.filename,
+            'start_lineno': location.start_lineno,
+            'start_col': location.start_col,
+            'end_lineno': location.end_lineno,
+            'end_col': location.end_col,
+            'score': score,
+            'matches': [],
+        })
+        record['score'] = max(record['score'], score)
+        record['matches'].append({
+            'pattern': str(match.pattern.value),
+            'checker': checker_name(match.check_fn),
+            'score': score,
+            'spans': match.result.spans,
+        })
+    return list(records.values())
+
+
+def print_records(records: Iterable[dict]) -> None:
+    for record in records:
+        print(json.dumps(record))
+
+
+def main_batch(args) -> None:
+    """Match every query from --queries-from against one scan of the files."""
+    if args.stream:
+        for file_matches in scan_files(find_files(args.paths, make_walker(args)), args):
+            matches_by_text: Dict[str, set] = {}
+            for match in file_matches:
+                matches_by_text.setdefault(match.text, set()).add(match)
+            for text, matches in matches_by_text.items():
+                print_records(scored_matches_to_records(score_matches(matches, args, relative=False)))
+            sys.stdout.flush()
+        return
+
+    matches_by_text = {text: set() for text in args.texts}
+    for file_matches in scan_files(find_files(args.paths, make_walker(args)), args):
+        for match in file_matches:
+            matches_by_text[match.text].add(match)
+
+    for text, matches in matches_by_text.items():
+        print_records(scored_matches_to_records(score_matches(matches, args)))
+
+
+def main() -> None:
+    if sys.argv[1:2] in (['serve'], ['query']):
+        # `perg serve` and `perg query` are subcommands; use `perg -- serve` to search for the text "serve".
+        from perg import server
+        server.main(sys.argv[1], sys.argv[2:])
+        return
+
+    args = parse_args()
+    try:
+        main_search(args)
+    finally:
+        if stats.STATS is not None:
+            stats.STATS.report()
+
+
+def main_search(args) -> None:
+    if args.queries_from is not None:
+        main_batch(args)
+        return
+
+    if args.stream:
+        # Every match for a location comes from the same file, so each file's matches can be
+        # printed as soon as that file has been scanned.
+        for file_matches in scan_files(find_files(args.paths, make_walker(args)), args):
+            print_scored_matches(score_matches(set(file_matches), args, relative=False), args)
+            sys.stdout.flush()
+        return
+
+    matches = set()
+    for file_matches in scan_files(find_files(args.paths, make_walker(args)), args):
+        matches.update(file_matches)
+
+    print_scored_matches(score_matches(matches, args), args)
+
 if __name__ == "__main__":
     main()
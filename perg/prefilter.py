@@ -0,0 +1,94 @@
+"""Cheaply rule out patterns that can't possibly match the text, before running their checkers.
+
+Almost every (pattern, checker) pair that perg tries fails to match. Many patterns contain literal
+text that any matching string must contain -- e.g. every string matching "foo .* baz" contains "foo "
+and " baz". We extract these required literals once per pattern, and skip the checker entirely if
+any of them is missing from the text. This is only ever allowed to produce false positives (patterns
+that get through the prefilter but don't match), never false negatives.
+
+This works for any checker registered with `perg.common_checkers.regex_equivalent`, as well as
+`check_string_match`. Patterns for other checkers always pass through.
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+from perg import CheckFunction
+from perg._sre import sre_constants
+from perg._sre import sre_parse
+from perg.common_checkers import COMPILE_CACHE_SIZE
+from perg.common_checkers import as_regex
+from perg.common_checkers import check_string_match
+
+
+_REPEATS = tuple(
+    getattr(sre_constants, name)
+    for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')  # POSSESSIVE_REPEAT is new in 3.11
+    if hasattr(sre_constants, name)
+)
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+
+
+def _literal_runs(items) -> Iterator[str]:
+    """Yield runs of literal characters that must appear, in order, in anything `items` matches."""
+    run: List[str] = []
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+
+        # Anything else ends the current run. We can still look inside some constructs for more
+        # required literals, as long as they're guaranteed to be matched at least once.
+        if run:
+            yield ''.join(run)
+            run = []
+
+        if op is sre_constants.SUBPATTERN:
+            _group, add_flags, _del_flags, sub = av
+            if not (add_flags & re.IGNORECASE):
+                yield from _literal_runs(sub)
+        elif op in _REPEATS:
+            min_repeat, _max_repeat, sub = av
+            if min_repeat >= 1:
+                yield from _literal_runs(sub)
+        elif _ATOMIC_GROUP is not None and op is _ATOMIC_GROUP:
+            yield from _literal_runs(av)
+
+    if run:
+        yield ''.join(run)
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def regex_required_literals(regex: str, flags: int) -> Tuple[str, ...]:
+    """Return substrings that every string matched by the regex must contain."""
+    try:
+        parsed = sre_parse.parse(regex, flags)
+    except Exception:
+        # Invalid regexes never match anything, but let the checker be the one to decide that.
+        return ()
+
+    if parsed.state.flags & re.IGNORECASE:
+        return ()
+
+    # Longest first, since they're the least likely to be in the text.
+    return tuple(sorted(set(_literal_runs(parsed)), key=len, reverse=True))
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def required_literals(check_fn: CheckFunction, pattern) -> Tuple[str, ...]:
+    """Return substrings that any text must contain for check_fn to match it against `pattern`."""
+    if check_fn is check_string_match:
+        return (pattern,) if pattern else ()
+
+    regex = as_regex(check_fn, pattern)
+    if regex is None:
+        return ()
+    return regex_required_literals(*regex)
+
+
+def may_match(check_fn: CheckFunction, pattern, text: str) -> bool:
+    """Return False if check_fn definitely won't match `pattern` against `text`."""
+    return all(literal in text for literal in required_literals(check_fn, pattern))
@@ -0,0 +1,277 @@
+"""`perg serve` and `perg query`: keep a repo's patterns in memory and answer queries over a socket.
+
+Every plain `perg` run pays for interpreter startup and for parsing every file before it can match
+anything. `perg serve` does that once, keeps the patterns each syntax found in each file, and then
+listens on a unix domain socket. `perg query` sends it a batch of texts and prints the results, in
+the same JSON lines format as `perg --queries-from`.
+
+The protocol is one JSON object per line. The client sends `{"queries": [...]}` and then shuts down
+its side of the connection; the server answers with one record per matching location (see
+`perg.perg.scored_matches_to_records`) and closes the connection. If the request is bad, the server
+instead sends a single `{"error": "..."}` line.
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import cast
+
+from perg import Pattern
+from perg import Syntax
+from perg.cache import default_cache_dir
+from perg.cache import PatternCache
+from perg.perg import build_arg_parser
+from perg.perg import find_files
+from perg.perg import find_syntaxes
+from perg.perg import make_walker
+from perg.perg import match_file_patterns
+from perg.perg import parse_args
+from perg.perg import parse_file_patterns
+from perg.perg import read_queries
+from perg.perg import score_matches
+from perg.perg import scored_matches_to_records
+from perg.syntaxes import _treesitter
+from perg.watch import Changes
+from perg.watch import make_watcher
+
+
+DEFAULT_KEPT_TREES = 1024
+
+
+def default_socket() -> str:
+    """The socket perg serve listens on (and perg query connects to) when run in this directory."""
+    return os.path.join(default_cache_dir(), 'perg.sock')
+
+
+class PatternStore:
+    """The patterns found in every file under some paths, kept in memory between queries."""
+
+    def __init__(self, paths: Sequence[str], args, cache: Optional[PatternCache] = None):
+        self.paths = list(paths)
+        self.args = args
+        self.cache = cache
+        self.all_syntaxes = find_syntaxes(args.syntax_allowlist)
+        self.walker = make_walker(args)
+        self.files: Dict[str, List[Tuple[Syntax, List[Pattern]]]] = {}
+        # Guards self.files, which a watcher thread may be updating while we answer queries.
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        for filename in find_files(self.paths, self.walker):
+            self.update(filename)
+        if self.cache is not None:
+            self.cache.commit()
+
+    def update(self, filename: str) -> None:
+        """(Re-)parse a file."""
+        try:
+            syntax_patterns = parse_file_patterns(filename, self.all_syntaxes, self.args, self.cache)
+        except Exception as e:
+            # A plain perg run would stop here (on PergSyntaxParseError, or on any error a syntax raises,
+            # unless --no-raise-errors is given), but one bad file shouldn't take down the server.
+            print(f"perg serve: skipping {filename}: {type(e).__name__}: {e}", file=sys.stderr)
+            self.remove(filename)
+            return
+        with self.lock:
+            self.files[filename] = syntax_patterns
+
+    def remove(self, path: str) -> None:
+        """Forget a file, or every file under a directory."""
+        prefix = os.path.join(path, '')
+        with self.lock:
+            for filename in [filename for filename in self.files if filename == path or filename.startswith(prefix)]:
+                del self.files[filename]
+
+    def apply(self, changes: Changes) -> None:
+        """Bring the store up to date with changes from a watcher."""
+        changed = changes.changed
+        if changes.rescan:
+            changed = set(find_files(self.paths, self.walker))
+            with self.lock:
+                gone = self.files.keys() - changed
+            for filename in gone:
+                self.remove(filename)
+        for path in changes.deleted:
+            self.remove(path)
+        for filename in changed:
+            # Watchers only skip dotfiles; this also skips what --exclude, ignore files etc. say to.
+            if os.path.isfile(filename) and self.walker.accepts(self.paths, filename):
+                self.update(filename)
+        if self.cache is not None:
+            self.cache.commit()
+
+    def query(self, texts: Sequence[str]) -> List[dict]:
+        with self.lock:
+            files = list(self.files.items())
+
+        matches_by_text: Dict[str, set] = {text: set() for text in texts}
+        for filename, syntax_patterns in files:
+            for match in match_file_patterns(filename, syntax_patterns, texts, self.args):
+                matches_by_text[match.text].add(match)
+
+        records = []
+        for text, matches in matches_by_text.items():
+            records.extend(scored_matches_to_records(score_matches(matches, self.args)))
+        return records
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+            queries = request['queries']
+            if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+                raise ValueError("queries must be a list of strings")
+        except (ValueError, KeyError, TypeError) as e:
+            self.send({'error': f"bad request: {e}"})
+            return
+
+        for record in cast(PergServer, self.server).store.query(queries):
+            self.send(record)
+
+    def send(self, record: dict) -> None:
+        self.wfile.write(json.dumps(record).encode() + b'\n')
+
+
+class PergServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path: str, store: PatternStore):
+        self.store = store
+        super().__init__(socket_path, QueryHandler)
+
+
+def bind_server(socket_path: str, store: PatternStore) -> PergServer:
+    if os.path.exists(socket_path):
+        # Only clean up after a server that's gone away; don't steal a live server's socket.
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)
+            else:
+                raise RuntimeError(f"a perg server is already listening on {socket_path}")
+    os.makedirs(os.path.dirname(socket_path) or '.', mode=0o700, exist_ok=True)
+    return PergServer(socket_path, store)
+
+
+def send_queries(socket_path: str, queries: Sequence[str]) -> List[dict]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({'queries': list(queries)}).encode() + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as f:
+            return [json.loads(line) for line in f]
+
+
+def parse_serve_args(argv: Sequence[str]):
+    parser = build_arg_parser()
+    parser.prog = 'perg serve'
+    parser.add_argument(
+        '--socket',
+        type=str,
+        default=None,
+        help="The unix domain socket to listen for queries on. Defaults to one in the current directory's cache"
+             " directory (see --cache-dir).",
+    )
+    parser.add_argument(
+        '--watch',
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Watch the paths for changes, and re-parse files as they change.",
+    )
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=None,
+        help="With --watch, poll for changes every this many seconds, rather than using inotify.",
+    )
+    parser.add_argument(
+        '--kept-trees',
+        type=int,
+        default=DEFAULT_KEPT_TREES,
+        help="With --watch, keep the syntax trees of this many recently parsed files in memory, so that"
+             " when they change, only the changed parts need to be reparsed.",
+    )
+    # Queries come in over the socket, so every positional argument is a path.
+    parser.set_defaults(texts=[])
+    args = parse_args(argv, parser)
+    if args.queries_from is not None or args.stream or args.jobs != 1 or args.parse_threads != 1 or args.stats:
+        parser.error("--queries-from, --stream, --jobs, --parse-threads and --stats can't be used with perg serve")
+    if args.socket is None:
+        args.socket = default_socket()
+    return args
+
+
+def serve(argv: Sequence[str]) -> None:
+    args = parse_serve_args(argv)
+    cache = PatternCache(args.cache_dir) if args.cache else None
+    if args.watch:
+        _treesitter.MAX_KEPT_TREES = args.kept_trees
+    store = PatternStore(args.paths, args, cache)
+    # Start watching before loading, so that nothing changed during the load gets missed.
+    watcher = make_watcher(args.paths, args.poll_interval, store.walker) if args.watch else None
+    store.load()
+    with bind_server(args.socket, store) as server:
+        print(f"perg serve: {len(store.files)} files loaded, listening on {args.socket}", file=sys.stderr)
+        try:
+            if watcher is None:
+                server.serve_forever()
+            else:
+                # The store is updated from this thread, since that's the one the cache belongs to.
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                while True:
+                    store.apply(watcher.changes())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
+            if watcher is not None:
+                watcher.close()
+
+
+def query(argv: Sequence[str]) -> None:
+    parser = argparse.ArgumentParser(prog='perg query')
+    parser.add_argument('texts', nargs='*', type=str, help="The texts to match patterns against.")
+    parser.add_argument(
+        '--queries-from',
+        type=str,
+        default=None,
+        metavar='FILE',
+        help="Also match patterns against each line of FILE (or stdin, for -).",
+    )
+    parser.add_argument(
+        '--socket',
+        type=str,
+        default=None,
+        help="The unix domain socket that perg serve is listening on, if it isn't perg serve's default.",
+    )
+    args = parser.parse_args(argv)
+    if args.socket is None:
+        args.socket = default_socket()
+    queries = list(args.texts)
+    if args.queries_from is not None:
+        queries.extend(read_queries(args.queries_from))
+    if not queries:
+        parser.error("no queries given")
+
+    for record in send_queries(args.socket, queries):
+        if 'error' in record:
+            sys.exit(f"perg query: {record['error']}")
+        print(json.dumps(record))
+
+
+def main(command: str, argv: Sequence[str]) -> None:
+    if command == 'serve':
+        serve(argv)
+    elif command == 'query':
+        query(argv)
+    else:
+        raise ValueError(f"unknown command {command}")
@@ -0,0 +1,49 @@
+"""Cheaply classify a file before any syntax reads it.
+
+Syntaxes with MAYBE relevance get every file they don't recognize, so without this, minified
+bundles, data dumps and binaries get read in full and parsed, only to yield nothing (or fail). Looking
+at the first few KB is enough to rule most of them out:
+
+- A NUL byte means the file is binary (or UTF-16, which no syntax reads either), and isn't searched.
+- Bytes that aren't valid UTF-8 mean the syntaxes that decode the file would fail on it, so only
+  syntaxes that are sure they're relevant (by the file's extension) are tried.
+"""
+
+import codecs
+from enum import Enum
+from typing import Tuple
+
+from perg.source import SourceFile
+
+
+# How much of the start of a file to look at.
+SNIFF_SIZE = 8192
+
+
+class FileKind(Enum):
+    TEXT = 'text'
+    NOT_UTF8 = 'not-utf8'
+    BINARY = 'binary'
+
+
+def sniff_bytes(head: bytes) -> FileKind:
+    if b'\0' in head:
+        return FileKind.BINARY
+    try:
+        # Not final: head may end partway through a character.
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return FileKind.NOT_UTF8
+    return FileKind.TEXT
+
+
+def sniff_source(source: SourceFile) -> Tuple[FileKind, int]:
+    """Return what kind of file this is, and its size. This reads the start of the SourceFile the
+    syntaxes will share, rather than opening the file separately. If it can't be read, say it's
+    text, and let the syntaxes report the error as they would have."""
+    try:
+        data = source.raw
+    except OSError:
+        return FileKind.TEXT, 0
+    return sniff_bytes(data[:SNIFF_SIZE]), len(data)
+
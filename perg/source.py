@@ -0,0 +1,142 @@
+"""Shared access to source files.
+
+`SourceFile` holds one file's contents while it's being scanned, so that every syntax tried on it
+(and the pattern cache, and the binary sniffing) share a single read of the file, and a single
+decoding of it for the syntaxes that want text.
+
+`line_index` is for printing matches with context. A file with many matches would otherwise be read
+in full once per match. Instead, each file is read once, the offsets of its line breaks are found
+the first time a line is asked for, and individual lines are decoded on demand, so printing a match
+costs O(context lines).
+
+Files are read into bytes rather than memory-mapped: if a mapped file is truncated while it's being
+read (e.g. by an editor saving it while `perg serve --watch` reparses it), the process dies with
+SIGBUS.
+"""
+
+import io
+from array import array
+from functools import cached_property
+from functools import lru_cache
+from typing import Optional
+
+
+# How many files' line indexes to keep around at once.
+LINE_INDEX_CACHE_SIZE = 64
+
+
+def read_file(filename: str) -> bytes:
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+class LineIndex:
+    def __init__(self, data: bytes):
+        self.data = data
+        self._starts: Optional[array] = None
+
+    @classmethod
+    def from_file(cls, filename: str) -> 'LineIndex':
+        return cls(read_file(filename))
+
+    @property
+    def starts(self) -> array:
+        """The byte offset at which each line starts."""
+        if self._starts is None:
+            data = self.data
+            starts = array('Q', [0])
+            end = len(data)
+            pos = data.find(b'\n')
+            while pos != -1 and pos + 1 < end:
+                starts.append(pos + 1)
+                pos = data.find(b'\n', pos + 1)
+            if end == 0:
+                starts = array('Q')
+            self._starts = starts
+        return self._starts
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def line(self, lineno: int) -> str:
+        """Return line number `lineno` (1-indexed), without its line ending."""
+        starts = self.starts
+        start = starts[lineno - 1]
+        end = starts[lineno] if lineno < len(starts) else len(self.data)
+        line = self.data[start:end]
+        if line.endswith(b'\n'):
+            line = line[:-1]
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        return line.decode('utf-8', errors='replace')
+
+
+@lru_cache(maxsize=LINE_INDEX_CACHE_SIZE)
+def line_index(filename: str) -> LineIndex:
+    return LineIndex.from_file(filename)
+
+
+class SourceFile:
+    """One file's contents, read (at most) once and decoded (at most) once, however many syntaxes
+    look at it. Nothing is read until it's needed, so errors reading the file happen where they
+    would have if each syntax opened the file itself."""
+
+    def __init__(self, filename: str, raw=None):
+        self.filename = filename
+        if raw is not None:
+            self.raw = raw
+
+    @cached_property
+    def raw(self) -> bytes:
+        """The file's contents."""
+        return read_file(self.filename)
+
+    @cached_property
+    def data(self):
+        """The file's contents with line endings normalized to '\n', as reading it in text mode would."""
+        data = self.raw
+        if data.find(b'\r') != -1:
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        return data
+
+    @cached_property
+    def text(self) -> str:
+        """The file's contents, decoded. Raises UnicodeDecodeError if it isn't UTF-8."""
+        return str(self.data, 'utf-8')
+
+    @cached_property
+    def digest(self) -> str:
+        import hashlib  # only the pattern cache needs this.
+
+        return hashlib.blake2b(self.raw, digest_size=16).hexdigest()
+
+    def open(self, binary: bool):
+        """A file object reading the contents, for a syntax's parse()."""
+        if binary:
+            return SourceReader(self)
+        try:
+            return io.StringIO(self.text)
+        except UnicodeDecodeError:
+            # Fail when it's read, as a file opened in text mode would.
+            return io.TextIOWrapper(io.BytesIO(self.data), encoding='utf-8')
+
+
+class SourceReader(io.RawIOBase):
+    """A binary file object over a SourceFile. Syntaxes should read it with
+    perg.syntaxes.read_source_bytes, which takes the SourceFile's contents as they are, rather than
+    copying them out."""
+
+    def __init__(self, source: SourceFile):
+        super().__init__()
+        self.source = source
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.source.data
+        n = max(0, min(len(buffer), len(data) - self.position))
+        buffer[:n] = data[self.position:self.position + n]
+        self.position += n
+        return n
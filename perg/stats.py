@@ -0,0 +1,181 @@
+"""Counters for --stats: where a perg run spends its time.
+
+The instrumented code in perg.perg and perg.heuristics checks `STATS is not None` before doing any
+timing or counting, so none of this costs anything unless --stats is given.
+
+A run goes through these stages, and each one is timed separately:
+
+- walk: finding files
+- parse: running the syntaxes over each file (also broken down by syntax)
+- check: running each pattern's checkers (after the prefilter) against the texts
+- first_pass: the cheap heuristics, like pattern_matches_single_char
+- score: scoring the surviving matches with heuristics.information
+"""
+
+import heapq
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict
+from typing import IO
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+
+
+STAGES = ('walk', 'parse', 'check', 'first_pass', 'score')
+
+# What the `items` of each stage are.
+STAGE_ITEMS = {
+    'walk': 'files',
+    'parse': 'patterns',
+    'check': 'matches',
+    'first_pass': 'matches kept',
+    'score': 'matches scored',
+}
+
+# The Stats being collected, or None when --stats isn't given.
+STATS: Optional['Stats'] = None
+
+T = TypeVar('T')
+Clock = Tuple[float, float]
+
+
+def clock() -> Clock:
+    return time.perf_counter(), time.process_time()
+
+
+@dataclass
+class Counter:
+    calls: int = 0
+    items: int = 0
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+
+    def merge(self, other: 'Counter') -> None:
+        self.calls += other.calls
+        self.items += other.items
+        self.seconds += other.seconds
+        self.cpu_seconds += other.cpu_seconds
+
+
+class Stats:
+    def __init__(self, top: int = 0):
+        # How many of the slowest files and patterns to report.
+        self.top = top
+        self.start = clock()
+        self.stages: Dict[str, Counter] = {stage: Counter() for stage in STAGES}
+        self.syntaxes: Dict[str, Counter] = {}
+        # Everything else worth counting, like how many times each heuristic ran.
+        self.counts: Dict[str, int] = {}
+        self.file_seconds: Dict[str, float] = {}
+        self.pattern_seconds: Dict[str, float] = {}
+        # Whether any of these stats came from --jobs workers.
+        self.merged = False
+        # --parse-threads threads add to these while the main thread does too.
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, start: Clock, items: int = 0, syntax: Optional[str] = None) -> Clock:
+        """Add the time since `start` to a stage (and syntax, if given). Returns the current clock, to
+        start timing whatever comes next."""
+        now = clock()
+        with self._lock:
+            counters = [self.stages[stage]]
+            if syntax is not None:
+                counters.append(self.syntaxes.setdefault(syntax, Counter()))
+            for counter in counters:
+                counter.calls += 1
+                counter.items += items
+                counter.seconds += now[0] - start[0]
+                counter.cpu_seconds += now[1] - start[1]
+        return now
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def add_file(self, filename: str, start: Clock) -> None:
+        if self.top:
+            with self._lock:
+                self.file_seconds[filename] = self.file_seconds.get(filename, 0.0) + time.perf_counter() - start[0]
+
+    def add_pattern(self, pattern, start: Clock) -> None:
+        if self.top:
+            location = pattern.location
+            key = f"{location.filename}:{location.start_lineno}:{location.start_col}: {pattern.value!r}"
+            self.pattern_seconds[key] = self.pattern_seconds.get(key, 0.0) + time.perf_counter() - start[0]
+
+    def timed_iter(self, stage: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Yield from iterable, adding the time spent producing each item to stage."""
+        iterator = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, start, items=1)
+            yield item
+
+    def prune(self) -> None:
+        """Forget all but the slowest files and patterns; the rest will never be reported."""
+        for attr in ('file_seconds', 'pattern_seconds'):
+            slowest = heapq.nlargest(self.top, getattr(self, attr).items(), key=lambda item: item[1])
+            setattr(self, attr, dict(slowest))
+
+    def merge(self, other: 'Stats') -> None:
+        """Add in the stats from another process (a --jobs worker)."""
+        self.merged = True
+        for stage, counter in other.stages.items():
+            self.stages[stage].merge(counter)
+        for syntax, counter in other.syntaxes.items():
+            self.syntaxes.setdefault(syntax, Counter()).merge(counter)
+        for name, n in other.counts.items():
+            self.count(name, n)
+        for attr in ('file_seconds', 'pattern_seconds'):
+            mine = getattr(self, attr)
+            for key, seconds in getattr(other, attr).items():
+                mine[key] = mine.get(key, 0.0) + seconds
+
+    def report(self, out: IO[str] = sys.stderr) -> None:
+        end = clock()
+        print(f"{'stage':<24} {'wall s':>9} {'cpu s':>9} {'calls':>9} {'items':>9}", file=out)
+
+        def row(name: str, counter: Counter, items: str = '') -> None:
+            print(
+                f"{name:<24} {counter.seconds:>9.3f} {counter.cpu_seconds:>9.3f} {counter.calls:>9} {counter.items:>9}"
+                f"  {items}".rstrip(),
+                file=out,
+            )
+
+        for stage in STAGES:
+            row(stage, self.stages[stage], STAGE_ITEMS[stage])
+            if stage == 'parse':
+                for syntax, counter in sorted(self.syntaxes.items()):
+                    row(f"  {syntax}", counter)
+        print(f"{'total':<24} {end[0] - self.start[0]:>9.3f} {end[1] - self.start[1]:>9.3f}", file=out)
+        if self.merged:
+            print("(stage times are summed across --jobs worker processes)", file=out)
+
+        if self.counts:
+            print(file=out)
+            for name, n in sorted(self.counts.items()):
+                print(f"{name:<48} {n:>12}", file=out)
+
+        for title, seconds_by_key in (('slowest files', self.file_seconds), ('slowest patterns', self.pattern_seconds)):
+            if self.top and seconds_by_key:
+                print(f"\n{title}:", file=out)
+                for key, seconds in heapq.nlargest(self.top, seconds_by_key.items(), key=lambda item: item[1]):
+                    print(f"{seconds:>9.4f}s  {key}", file=out)
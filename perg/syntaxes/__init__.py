@@ -1,5 +1,10 @@
+import importlib
+import io
 from enum import Enum
 
+from perg.source import SourceFile
+from perg.source import SourceReader
+
 
 class Relevance(Enum):
 	NO = 0
@@ -9,3 +14,74 @@ class Relevance(Enum):
 
 class PergSyntaxParseError(Exception):
 	pass
+
+
+class LazySyntax:
+	"""A syntax module that's only imported once a file needs parsing with it.
+
+	Every syntax is asked about every file's relevance, so that's answered here from the file's
+	extension, without importing the module (which, for the tree-sitter syntaxes, loads a grammar).
+	Anything else, like parse, is looked up on the module, importing it the first time.
+	"""
+
+	def __init__(self, name, yes=(), no=(), otherwise=Relevance.MAYBE):
+		self.__name__ = f'perg.syntaxes.{name}'
+		self.yes = tuple(yes)
+		self.no = tuple(no)
+		self.otherwise = otherwise
+		self._module = None
+
+	def check_relevance(self, filename):
+		if filename.endswith(self.yes):
+			return Relevance.YES
+		if filename.endswith(self.no):
+			return Relevance.NO
+		return self.otherwise
+
+	@property
+	def module(self):
+		if self._module is None:
+			self._module = importlib.import_module(self.__name__)
+		return self._module
+
+	def __getattr__(self, attr):
+		return getattr(self.module, attr)
+
+	def __repr__(self):
+		return f"<syntax {self.__name__!r}{'' if self._module is None else ' (imported)'}>"
+
+
+# The syntaxes that come with perg, and which files each is relevant to. Other modules in this package
+# are still found by perg.perg.find_syntaxes, but imported up front to check their relevance.
+SYNTAXES = {
+	'bash': LazySyntax('bash', yes=('.sh',)),
+	'general': LazySyntax('general'),
+	'python': LazySyntax('python', yes=('.py', '.pyi', '.pyx'), no=('.pyc',)),
+}
+
+
+def open_source(syntax, source):
+	"""Open a file to pass to syntax.parse, from a perg.source.SourceFile (or a filename). Syntaxes
+	that set BINARY = True get a binary file, which they should read with read_source_bytes; others
+	get a text file."""
+	if isinstance(source, str):
+		source = SourceFile(source)
+	return source.open(binary=getattr(syntax, 'BINARY', False))
+
+
+def read_source_bytes(f):
+	"""Read the contents of a source file as bytes, without decoding it.
+
+	Files from open_source share their SourceFile's contents, rather than reading them again. Text files (e.g. a StringIO) are encoded as UTF-8. Line endings are
+	normalized to '\n', as they would be when reading in text mode.
+	"""
+	if isinstance(f, SourceReader):
+		return f.source.data
+
+	if isinstance(f, io.TextIOBase):
+		return f.read().encode()
+
+	data = f.read()
+	if data.find(b'\r') != -1:
+		data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+	return data
@@ -0,0 +1,302 @@
+"""Helpers shared by the syntaxes that are built on tree-sitter. (Not a syntax itself.)
+
+The interesting part is incremental reparsing. A long-running perg (see `perg.server`) re-parses a
+file every time it changes, but usually only a line or two has changed. If we kept the file's
+previous contents and tree, we can tell tree-sitter what was edited and let it reuse the rest of the
+old tree, then only look for patterns in the parts of the new tree that changed. Patterns from the
+rest of the file are reused, shifted to their new positions.
+
+This is off unless MAX_KEPT_TREES is set above 0, since it means keeping every file's contents and
+tree in memory, which is a waste for a one-off run.
+
+A tree-sitter Parser can't be used by two threads at once, so each syntax has a ParserPool, which
+gives every thread that parses its own Parser (see --parse-threads).
+"""
+
+import dataclasses
+import threading
+from collections import OrderedDict
+from typing import Callable
+from typing import Collection
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from tree_sitter import Language
+from tree_sitter import Node
+from tree_sitter import Parser
+from tree_sitter import Tree
+
+from perg import Location
+from perg import Pattern
+
+
+# How many files' trees to keep for incremental reparsing. 0 disables it.
+MAX_KEPT_TREES = 0
+
+# When diffing old and new contents, compare this many bytes at a time before narrowing down.
+_DIFF_CHUNK = 1 << 16
+
+ByteRange = Tuple[int, int]
+Point = Tuple[int, int]
+
+
+def overlaps(start_byte: int, end_byte: int, ranges: Iterable[ByteRange]) -> bool:
+    """Whether [start_byte, end_byte] touches any of the ranges. (Inclusive, so that empty ranges,
+    e.g. where something was deleted, still count.)"""
+    return any(start_byte <= range_end and end_byte >= range_start for range_start, range_end in ranges)
+
+
+def node_location(node: Node, filename: str) -> Location:
+    start_row, start_col = node.start_point
+    end_row, end_col = node.end_point
+    # tree-sitter uses 0-indexed lines, where we want 1-indexed. Most patterns are on one line, and
+    # sharing the int object then saves a little memory for each one (past the small int cache).
+    start_lineno = start_row + 1
+    end_lineno = start_lineno if end_row == start_row else end_row + 1
+    return Location(
+        filename=filename,
+        start_lineno=start_lineno,
+        start_col=start_col,
+        end_lineno=end_lineno,
+        end_col=end_col,
+    )
+
+
+def find_nodes(node: Node, node_types: Collection[str], ranges: Optional[Sequence[ByteRange]] = None) -> List[Node]:
+    """Find the nodes under node whose type is in node_types, in document order, without looking
+    inside them. If ranges is given, only look at nodes that overlap them.
+
+    This walks the tree with a TreeCursor rather than recursing, so deeply nested code can't hit the
+    recursion limit, and there's no generator frame per node.
+    """
+    found = []
+    cursor = node.walk()
+    while True:
+        current = cursor.node
+        assert current is not None  # the cursor is always on a node of the tree it walks.
+        if ranges is None or overlaps(current.start_byte, current.end_byte, ranges):
+            if current.type in node_types:
+                found.append(current)
+            elif cursor.goto_first_child():
+                continue
+        # Done with this subtree; move on to the next sibling of it or of its nearest ancestor.
+        while not cursor.goto_next_sibling():
+            if not cursor.goto_parent():
+                return found
+
+
+class Edit(NamedTuple):
+    """The arguments to tree_sitter.Tree.edit."""
+    start_byte: int
+    old_end_byte: int
+    new_end_byte: int
+    start_point: Point
+    old_end_point: Point
+    new_end_point: Point
+
+
+def _point(source: bytes, byte: int) -> Point:
+    row = source.count(b'\n', 0, byte)
+    return row, byte - (source.rfind(b'\n', 0, byte) + 1)
+
+
+def _match_length(same: Callable[[int, int], bool], limit: int) -> int:
+    """Given same(start, end), which says whether two sequences agree on [start, end), return how
+    far from 0 they agree, up to limit."""
+    # Skip ahead a chunk at a time, then binary search the chunk where they first differ.
+    start = 0
+    while start < limit:
+        end = min(start + _DIFF_CHUNK, limit)
+        if not same(start, end):
+            break
+        start = end
+    else:
+        return limit
+
+    lo, hi = start, end - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if same(start, mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def compute_edit(old: bytes, new: bytes) -> Optional[Edit]:
+    """Describe the change from old to new as a single edit, replacing everything between their
+    common prefix and common suffix. Returns None if they're the same."""
+    if old == new:
+        return None
+    limit = min(len(old), len(new))
+    prefix = _match_length(lambda start, end: old[start:end] == new[start:end], limit)
+    len_old, len_new = len(old), len(new)
+    suffix = _match_length(
+        lambda start, end: old[len_old - end:len_old - start] == new[len_new - end:len_new - start],
+        limit - prefix,  # the suffix can't overlap the prefix.
+    )
+    return Edit(
+        start_byte=prefix,
+        old_end_byte=len_old - suffix,
+        new_end_byte=len_new - suffix,
+        start_point=_point(old, prefix),
+        old_end_point=_point(old, len_old - suffix),
+        new_end_point=_point(new, len_new - suffix),
+    )
+
+
+def _shift_point(lineno: int, col: int, edit: Edit) -> Tuple[int, int]:
+    """Move a (1-indexed) position that came after an edit to where it is after the edit."""
+    old_end_row, old_end_col = edit.old_end_point
+    new_end_row, new_end_col = edit.new_end_point
+    if lineno - 1 == old_end_row:
+        col += new_end_col - old_end_col
+    return lineno + new_end_row - old_end_row, col
+
+
+def _shift_pattern(pattern: Pattern, edit: Edit) -> Pattern:
+    location = pattern.location
+    old_end_row, new_end_row = edit.old_end_point[0], edit.new_end_point[0]
+    if old_end_row == new_end_row and old_end_row + 1 not in (location.start_lineno, location.end_lineno):
+        # No lines were added or removed, and only things on the edit's last line moved sideways.
+        return pattern
+    start_lineno, start_col = _shift_point(location.start_lineno, location.start_col, edit)
+    end_lineno, end_col = _shift_point(location.end_lineno, location.end_col, edit)
+    return dataclasses.replace(
+        pattern,
+        location=Location(
+            filename=location.filename,
+            start_lineno=start_lineno,
+            start_col=start_col,
+            end_lineno=end_lineno,
+            end_col=end_col,
+        ),
+    )
+
+
+# (start_byte, end_byte) of the node a pattern came from, and the pattern.
+_Entry = Tuple[int, int, Pattern]
+
+
+class _KeptFile(NamedTuple):
+    source: bytes
+    tree: Tree
+    entries: List[_Entry]
+
+
+class ParserPool:
+    """A tree-sitter Parser for a language per thread, created the first time each thread parses.
+
+    The language itself is loaded (by calling `load_language`) the first time anything is parsed, so
+    that importing a syntax, e.g. to unpickle cached patterns that use its checkers, doesn't load its
+    grammar.
+    """
+
+    def __init__(self, load_language: Callable[[], Language]):
+        self.load_language = load_language
+        self._language: Optional[Language] = None
+        self._local = threading.local()
+
+    @property
+    def language(self) -> Language:
+        if self._language is None:
+            self._language = self.load_language()
+        return self._language
+
+    @property
+    def parser(self) -> Parser:
+        parser = getattr(self._local, 'parser', None)
+        if parser is None:
+            parser = self._local.parser = Parser(self.language)
+        return parser
+
+    def parse(self, source: bytes, old_tree: Optional[Tree] = None) -> Tree:
+        if old_tree is None:
+            return self.parser.parse(source)
+        return self.parser.parse(source, old_tree)
+
+
+class TreeParser:
+    """Parse files with a tree-sitter parser and pull patterns out of the trees, reparsing
+    incrementally when MAX_KEPT_TREES allows.
+
+    `pattern_nodes(root, ranges)` should yield the nodes that patterns come from, in order, only
+    looking at nodes that overlap `ranges` (if it isn't None). `patterns_from_node(node, filename)`
+    should yield the patterns from one of those nodes.
+    """
+
+    def __init__(
+        self,
+        parsers: ParserPool,
+        pattern_nodes: Callable[[Node, Optional[Sequence[ByteRange]]], Iterator[Node]],
+        patterns_from_node: Callable[[Node, str], Iterator[Pattern]],
+    ):
+        self.parsers = parsers
+        self.pattern_nodes = pattern_nodes
+        self.patterns_from_node = patterns_from_node
+        self.kept: 'OrderedDict[str, _KeptFile]' = OrderedDict()
+        self._kept_lock = threading.Lock()
+
+    def extract(self, root: Node, filename: str, ranges: Optional[Sequence[ByteRange]] = None) -> Iterator[_Entry]:
+        for node in self.pattern_nodes(root, ranges):
+            for pattern in self.patterns_from_node(node, filename):
+                yield node.start_byte, node.end_byte, pattern
+
+    def parse(self, source, filename: str) -> Iterator[Pattern]:
+        if MAX_KEPT_TREES <= 0:
+            self.kept.clear()
+            tree = self.parsers.parse(source)
+            for node in self.pattern_nodes(tree.root_node, None):
+                yield from self.patterns_from_node(node, filename)
+            return
+
+        source = bytes(source)
+        # If extracting patterns fails, this file is forgotten, and gets a full parse next time.
+        with self._kept_lock:
+            previous = self.kept.pop(filename, None)
+        if previous is None:
+            tree = self.parsers.parse(source)
+            entries = list(self.extract(tree.root_node, filename))
+        elif (edit := compute_edit(previous.source, source)) is None:
+            tree, entries = previous.tree, previous.entries
+        else:
+            tree, entries = self.reparse(previous, source, edit, filename)
+
+        with self._kept_lock:
+            self.kept[filename] = _KeptFile(source, tree, entries)
+            while len(self.kept) > MAX_KEPT_TREES:
+                self.kept.popitem(last=False)
+        for _, _, pattern in entries:
+            yield pattern
+
+    def reparse(self, previous: _KeptFile, source: bytes, edit: Edit, filename: str) -> Tuple[Tree, List[_Entry]]:
+        old_tree = previous.tree
+        old_tree.edit(*edit)
+        tree = self.parsers.parse(source, old_tree)
+        if tree.root_node.has_error:
+            # Error recovery can go differently when parts of the old tree are reused (bash's grammar
+            # in particular), so a broken file gets the same tree a cold parse would give it.
+            tree = self.parsers.parse(source)
+            return tree, list(self.extract(tree.root_node, filename))
+        # changed_ranges only covers changes to the tree's structure, not e.g. the text of a string.
+        ranges = [(r.start_byte, r.end_byte) for r in old_tree.changed_ranges(tree)]
+        ranges.append((edit.start_byte, edit.new_end_byte))
+
+        delta = edit.new_end_byte - edit.old_end_byte
+        entries = []
+        for start_byte, end_byte, pattern in previous.entries:
+            if start_byte > edit.old_end_byte:
+                start_byte, end_byte, pattern = start_byte + delta, end_byte + delta, _shift_pattern(pattern, edit)
+            elif end_byte >= edit.start_byte:
+                continue  # the edit touched this node.
+            if not overlaps(start_byte, end_byte, ranges):
+                entries.append((start_byte, end_byte, pattern))
+
+        entries.extend(self.extract(tree.root_node, filename, ranges))
+        entries.sort(key=lambda entry: entry[0])  # stable, so a node's patterns stay in order.
+        return tree, entries
@@ -1,24 +1,35 @@
 import shlex
 
-import tree_sitter_bash
-from tree_sitter import Language, Parser
+from tree_sitter import Language
 
 from perg.common_checkers import check_match_re_simple
 from perg.common_checkers import check_match_re_verbose
 from perg.common_checkers import check_shell_glob
-from perg.syntaxes import Relevance
+from perg.syntaxes import SYNTAXES
 from perg.syntaxes import PergSyntaxParseError
+from perg.syntaxes import read_source_bytes
+from perg.syntaxes._treesitter import ParserPool
+from perg.syntaxes._treesitter import TreeParser
+from perg.syntaxes._treesitter import find_nodes
+from perg.syntaxes._treesitter import node_location
 from perg import Pattern
-from perg import Location
 
 
-BASH_LANGUAGE = Language(tree_sitter_bash.language())
-parser = Parser(BASH_LANGUAGE)
+def load_language() -> Language:
+    import tree_sitter_bash
+
+    return Language(tree_sitter_bash.language())
+
+
+parsers = ParserPool(load_language)
+
+# parse() takes a binary file, and hands its bytes straight to tree-sitter.
+BINARY = True
 
 
 def print_example_tree():
     source = open('test_inputs/shell.sh').read()
-    tree = parser.parse(source.encode())
+    tree = parsers.parse(source.encode())
     root_node = tree.root_node
     def print_node(node, indent=0):
         start_line, start_col = node.start_point
@@ -36,11 +47,7 @@ def print_example_tree():
     print_node(root_node)
 
 
-def check_relevance(filename):
-    if filename.endswith('.sh'):
-        return Relevance.YES
-    else:
-        return Relevance.MAYBE
+check_relevance = SYNTAXES['bash'].check_relevance
 
 
 WILDCARD = object()
@@ -82,64 +89,70 @@ def regexes_from_node(node, filename):
         raise PergSyntaxParseError(f"Unknown node type: {node.type}")
 
 
-def parse_node(node, filename):
+PATTERN_NODE_TYPES = frozenset(('word', 'raw_string', 'extglob_pattern', 'ansi_c_string', 'string', 'heredoc_body', 'concatenation'))
+
+
+# The checkers to use on bash strings, and what to replace variables with for each.
+WILDCARD_VALUES = (
+    ((check_match_re_simple,), '.*'),
+    ((check_match_re_verbose,), '.*'),
+    ((check_shell_glob,), '*'),
+)
+
+
+def patterns_from_node(node, filename):
     """Wrap regexes from regexes_from_node in Pattern objects."""
-    if node.type in ('word', 'raw_string', 'extglob_pattern', 'ansi_c_string', 'string', 'heredoc_body', 'concatenation'):
-        regex_parts = regexes_from_node(node, filename)
-        for check_fn, wildcard_value in (
-            (check_match_re_simple, '.*'),
-            (check_match_re_verbose, '.*'),
-            (check_shell_glob, '*'),
-        ):
-            regex = ''.join(
-                part if part is not WILDCARD else wildcard_value
-                for part in regex_parts
-            )
+    regex_parts = regexes_from_node(node, filename)
+    location = node_location(node, filename)
+    for check_fns, wildcard_value in WILDCARD_VALUES:
+        regex = ''.join(
+            part if part is not WILDCARD else wildcard_value
+            for part in regex_parts
+        )
 
-            yield Pattern(
-                location=Location(
-                    filename=filename,
-                    start_lineno=node.start_point[0] + 1,
-                    start_col=node.start_point[1],
-                    end_lineno=node.end_point[0] + 1,
-                    end_col=node.end_point[1],
-                ),
-                value=regex,
-                check_fns=(check_fn,),
-            )
+        yield Pattern(
+            location=location,
+            value=regex,
+            check_fns=check_fns,
+        )
 
-            # If the regex contains a newline, yield a Pattern for each line.
-            if '\n' in regex:
-                for line in regex.split('\n'):
-                    yield Pattern(
-                        location=Location(
-                            # TODO: this location is arguably not correct -- this will show e.g. the entire heredoc, rather than the single line within the heredoc.
-                            filename=filename,
-                            start_lineno=node.start_point[0] + 1,
-                            start_col=node.start_point[1],
-                            end_lineno=node.end_point[0] + 1,
-                            end_col=node.end_point[1],
-                        ),
-                        value=line,
-                        check_fns=(check_fn,),
-                    )
-    elif hasattr(node, 'children') and node.children:
-        for child in node.children:
-            yield from parse_node(child, filename)
+        # If the regex contains a newline, yield a Pattern for each line.
+        if '\n' in regex:
+            for line in regex.split('\n'):
+                yield Pattern(
+                    # TODO: this location is arguably not correct -- this will show e.g. the entire heredoc, rather than the single line within the heredoc.
+                    location=location,
+                    value=line,
+                    check_fns=check_fns,
+                )
+
+
+def pattern_nodes(node, ranges=None):
+    """Find the nodes under node that patterns come from, only looking at nodes that overlap ranges (if given)."""
+    return find_nodes(node, PATTERN_NODE_TYPES, ranges)
+
+
+def parse_node(node, filename):
+    for pattern_node in pattern_nodes(node):
+        yield from patterns_from_node(pattern_node, filename)
+
+
+trees = TreeParser(parsers, pattern_nodes, patterns_from_node)
 
 
 def source_to_node(source):
-    tree = parser.parse(source.encode())
+    if isinstance(source, str):
+        source = source.encode()
+    tree = parsers.parse(source)
     return tree.root_node
 
 
 def parse(f, filename):
     try:
-        source = f.read()
+        yield from trees.parse(read_source_bytes(f), filename)
     except UnicodeDecodeError:
-        raise PergSyntaxParseError()
-    node = source_to_node(source)
-    yield from parse_node(node, filename)
+        # We only decode the strings we find, so a file is only rejected if one of those isn't UTF-8.
+        raise PergSyntaxParseError(f"{filename} is not valid UTF-8")
 
 if __name__ == '__main__':
     print_example_tree()
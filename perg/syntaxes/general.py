@@ -3,13 +3,12 @@
 import re
 import ast
 from perg.common_checkers import ALL_COMMON
-from perg.syntaxes import Relevance
+from perg.syntaxes import SYNTAXES
 from perg import Pattern
 from perg import Location
 
 
-def check_relevance(filename):
-    return Relevance.MAYBE
+check_relevance = SYNTAXES['general'].check_relevance
 
 
 def parse(f, filename):
@@ -19,15 +18,15 @@ def parse(f, filename):
     except UnicodeDecodeError:
         pass
     else:
-        for lineno, line in enumerate(lines):
+        for lineno, line in enumerate(lines, start=1):
             for match in stringRE.finditer(line.rstrip('\n')):
                 literal = line[match.start():match.end()]
                 yield Pattern(
                     location=Location(
                         filename=filename,
-                        start_lineno=lineno + 1,
+                        start_lineno=lineno,
                         start_col=match.start(),
-                        end_lineno=lineno + 1,
+                        end_lineno=lineno,
                         end_col=match.end(),
                     ),
                     value=unquote(literal),
@@ -1,48 +1,73 @@
 import re
 import string
+from functools import lru_cache
+from typing import Optional
 
-import tree_sitter_python as tspython
-from tree_sitter import Language, Parser
+from tree_sitter import Language
 
 from perg.common_checkers import ALL_COMMON
+from perg.common_checkers import COMPILE_CACHE_SIZE
+from perg.common_checkers import RE_FLAGS
 from perg.common_checkers import check_match_re_simple
-from perg.syntaxes import Relevance
+from perg.common_checkers import regex_equivalent
+from perg.syntaxes import SYNTAXES
 from perg.syntaxes import PergSyntaxParseError
+from perg.syntaxes import read_source_bytes
+from perg.syntaxes._treesitter import ParserPool
+from perg.syntaxes._treesitter import TreeParser
+from perg.syntaxes._treesitter import find_nodes
+from perg.syntaxes._treesitter import node_location
 from perg import Pattern
-from perg import Location
 
 
-PY_LANGUAGE = Language(tspython.language())
-parser = Parser(PY_LANGUAGE)
+def load_language() -> Language:
+    import tree_sitter_python
 
+    return Language(tree_sitter_python.language())
 
-def check_relevance(filename):
-    for ext in ('.py', '.pyi', '.pyx'):
-        if filename.endswith(ext):
-            return Relevance.YES
 
-    # Definitely not Python
-    if filename.endswith('.pyc'):
-        return Relevance.NO
+parsers = ParserPool(load_language)
 
-    return Relevance.MAYBE
+# parse() takes a binary file, and hands its bytes straight to tree-sitter.
+BINARY = True
 
 
-def check_match_python_format_str(pattern, s, partial=False):
+# .py, .pyi and .pyx files are Python; .pyc files definitely aren't.
+check_relevance = SYNTAXES['python'].check_relevance
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def format_str_to_regex(pattern) -> Optional[str]:
+    """Convert a format string to a regex, or return None if it isn't a valid format string."""
     regex = ""
     try:
         parsed = list(string.Formatter().parse(pattern))
     except ValueError:
-        return False
+        return None
 
     for literal_text, field_name, format_spec, conversion in parsed:
         regex += re.escape(literal_text)
         if field_name is not None:
             regex += '.*'
+    return regex
+
+
+def check_match_python_format_str(pattern, s, partial=False):
+    regex = format_str_to_regex(pattern)
+    if regex is None:
+        return False
 
     return check_match_re_simple(regex, s, partial=partial)
 
 
+@regex_equivalent(check_match_python_format_str)
+def _format_str_as_regex(pattern):
+    regex = format_str_to_regex(pattern)
+    if regex is None:
+        return None
+    return regex, RE_FLAGS
+
+
 def node_to_string(node):
     if node.type == "string":
         if len(node.children) == 2:
@@ -99,13 +124,17 @@ def node_to_string(node):
 
 
 class FStringPattern:
-    def __init__(self, node):
-        self.node = node
+    """An f-string, checked as a regex in which each interpolation is `.*`.
 
-    def to_regex(self) -> str:
+    Only the regex is kept (not the tree-sitter node, which would keep the whole tree alive), and two
+    FStringPatterns with the same regex are equal, so identical f-strings share check results.
+    """
+    __slots__ = ('_regex',)
+
+    def __init__(self, node):
         regex = ""
 
-        for child in self.node.children:
+        for child in node.children:
             if child.type in ('string_start', 'string_end'):
                 continue
             elif child.type == 'string_content':
@@ -114,53 +143,81 @@ class FStringPattern:
                 regex += '.*'
             else:
                 raise NotImplementedError(f"dunno how to handle {child.type}")
-        return regex
+        self._regex = regex
+
+    def to_regex(self) -> str:
+        return self._regex
+
+    def __str__(self):
+        return self._regex
+
+    def __eq__(self, other):
+        if not isinstance(other, FStringPattern):
+            return NotImplemented
+        return self._regex == other._regex
+
+    def __hash__(self):
+        return hash((FStringPattern, self._regex))
+
+    def __getstate__(self):
+        return {'_regex': self._regex}
+
+    def __setstate__(self, state):
+        self._regex = state['_regex']
 
 
 def check_match_python_f_string(pattern, s, partial):
     return check_match_re_simple(pattern.to_regex(), s, partial)
 
 
-def parse_node(node, filename):
-    if node.type == "string":
-        if any([c.type == "interpolation" for c in node.children]):
-            yield Pattern(
-                location=Location(
-                    filename=filename,
-                    start_lineno=node.start_point[0] + 1,  # tree-sitter uses 0-indexed lines, where we want 1-indexed.
-                    start_col=node.start_point[1],
-                    end_lineno=node.end_point[0] + 1,  # tree-sitter uses 0-indexed lines, where we want 1-indexed.
-                    end_col=node.end_point[1],
-                ),
-                value=FStringPattern(node),
-                check_fns=(check_match_python_f_string,),
-            )
-        else:
-            yield Pattern(
-                location=Location(
-                    filename=filename,
-                    start_lineno=node.start_point[0] + 1,  # tree-sitter uses 0-indexed lines, where we want 1-indexed.
-                    start_col=node.start_point[1],
-                    end_lineno=node.end_point[0] + 1,  # tree-sitter uses 0-indexed lines, where we want 1-indexed.
-                    end_col=node.end_point[1],
-                ),
-                value=node_to_string(node),
-                check_fns=ALL_COMMON + (check_match_python_format_str,),
-            )
+@regex_equivalent(check_match_python_f_string)
+def _f_string_as_regex(pattern):
+    return pattern.to_regex(), RE_FLAGS
+
+
+# Shared by every pattern, rather than a new tuple for each.
+F_STRING_CHECK_FNS = (check_match_python_f_string,)
+STRING_CHECK_FNS = ALL_COMMON + (check_match_python_format_str,)
+
+
+def patterns_from_string_node(node, filename):
+    if any([c.type == "interpolation" for c in node.children]):
+        yield Pattern(
+            location=node_location(node, filename),
+            value=FStringPattern(node),
+            check_fns=F_STRING_CHECK_FNS,
+        )
     else:
-        for child in node.children:
-            yield from parse_node(child, filename)
+        yield Pattern(
+            location=node_location(node, filename),
+            value=node_to_string(node),
+            check_fns=STRING_CHECK_FNS,
+        )
+
+
+def string_nodes(node, ranges=None):
+    """Find the string nodes under node, only looking at nodes that overlap ranges (if given)."""
+    return find_nodes(node, ('string',), ranges)
+
+
+def parse_node(node, filename):
+    for string_node in string_nodes(node):
+        yield from patterns_from_string_node(string_node, filename)
+
+
+trees = TreeParser(parsers, string_nodes, patterns_from_string_node)
 
 
 def source_to_node(source):
-    tree = parser.parse(source.encode())
+    if isinstance(source, str):
+        source = source.encode()
+    tree = parsers.parse(source)
     return tree.root_node
 
 
 def parse(f, filename):
     try:
-        source = f.read()
+        yield from trees.parse(read_source_bytes(f), filename)
     except UnicodeDecodeError:
-        raise PergSyntaxParseError()
-    node = source_to_node(source)
-    yield from parse_node(node, filename)
+        # We only decode the strings we find, so a file is only rejected if one of those isn't UTF-8.
+        raise PergSyntaxParseError(f"{filename} is not valid UTF-8")
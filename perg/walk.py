@@ -0,0 +1,303 @@
+"""Find the files to search under some paths, skipping what .gitignore and .ignore files say to.
+
+Directories are listed with os.scandir on a pool of threads, each directory's subdirectories being
+queued as soon as it's been listed, so that slow filesystems (network mounts, cold caches) are kept
+busy. Files are still yielded in the same order a single-threaded os.walk would find them, so output
+doesn't depend on thread timing.
+
+Ignore files use (most of) gitignore's syntax: `#` comments, `!` to re-include, a trailing `/` to
+only match directories, a leading or middle `/` to anchor a pattern to the ignore file's directory,
+and `*`, `?`, `[...]` and `**` wildcards. Patterns in a directory's `.ignore` take precedence over its
+`.gitignore`, and both over those of its parents. Ignore files above the searched path are read too,
+up to the top of the git repository it's in (if any).
+
+Paths given explicitly (rather than found by walking a directory) are always searched.
+"""
+
+import fnmatch
+import os
+import re
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+
+IGNORE_FILES = ('.gitignore', '.ignore')
+DEFAULT_THREADS = 8
+
+
+class IgnoreRule(NamedTuple):
+    regex: re.Pattern
+    negate: bool
+    dir_only: bool
+
+
+def _translate(glob: str) -> str:
+    """Translate a gitignore glob (without its leading `!` or trailing `/`) to a regex that matches
+    paths relative to the ignore file's directory."""
+    anchored = '/' in glob
+    glob = glob.lstrip('/')
+    regex = ''
+    i = 0
+    while i < len(glob):
+        c = glob[i]
+        if glob.startswith('**/', i) and (i == 0 or glob[i - 1] == '/'):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if glob.startswith('**', i) and i + 2 == len(glob) and (i == 0 or glob[i - 1] == '/'):
+            regex += '.*'
+            i += 2
+            continue
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            end = glob.find(']', i + 2)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                body = glob[i + 1:end]
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                regex += '[' + body.replace('\\', '\\\\') + ']'
+                i = end
+        elif c == '\\' and i + 1 < len(glob):
+            i += 1
+            regex += re.escape(glob[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    # A pattern with no slash in it can match at any depth.
+    return regex if anchored else '(?:.*/)?' + regex
+
+
+def parse_ignore_file(lines: Sequence[str]) -> List[IgnoreRule]:
+    rules = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.endswith('\\ '):
+            line = line.rstrip(' ')
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line.startswith('\\'):
+            line = line[1:]  # e.g. \# or \!
+        dir_only = line.endswith('/')
+        if dir_only:
+            line = line[:-1]
+        try:
+            regex = re.compile(_translate(line) + r'\Z', re.DOTALL)
+        except re.error:
+            continue
+        rules.append(IgnoreRule(regex, negate, dir_only))
+    return rules
+
+
+class IgnoreFile(NamedTuple):
+    """The rules from the ignore files in one directory. `base` is that directory as it appears at
+    the start of the paths being walked, and `prefix` is the path from the directory to `base`, for
+    ignore files found above the path being walked (otherwise it's '')."""
+    base: str
+    prefix: str
+    rules: List[IgnoreRule]
+
+    def relative(self, path: str) -> str:
+        relative = path[len(self.base):].lstrip(os.sep)
+        if self.prefix:
+            relative = os.path.join(self.prefix, relative)
+        return relative.replace(os.sep, '/')
+
+
+def is_ignored(ignore_files: Sequence[IgnoreFile], path: str, is_dir: bool) -> bool:
+    ignored = False
+    # Later rules, and rules in deeper directories, win.
+    for ignore_file in ignore_files:
+        relative = None
+        for rule in ignore_file.rules:
+            if rule.dir_only and not is_dir:
+                continue
+            if relative is None:
+                relative = ignore_file.relative(path)
+            if rule.regex.match(relative):
+                ignored = not rule.negate
+    return ignored
+
+
+def read_ignore_files(directory: str, base: str, prefix: str = '') -> Optional[IgnoreFile]:
+    rules = []
+    for name in IGNORE_FILES:
+        try:
+            with open(os.path.join(directory, name), errors='replace') as f:
+                rules.extend(parse_ignore_file(list(f)))
+        except OSError:
+            pass
+    return IgnoreFile(base, prefix, rules) if rules else None
+
+
+def _matches_any(globs: Sequence[str], name: str, relative: str) -> bool:
+    return any(fnmatch.fnmatch(name, glob) or fnmatch.fnmatch(relative, glob) for glob in globs)
+
+
+class _Listing(NamedTuple):
+    files: List[str]
+    subdirs: List[str]
+    ignore_files: Tuple[IgnoreFile, ...]
+
+
+class Walker:
+    """Finds the files perg should search.
+
+    `include` and `exclude` are globs, matched against each file's name and its path relative to
+    the path being walked; `exclude` applies to directories too. Files bigger than `max_file_size`
+    bytes are skipped.
+    """
+
+    def __init__(
+        self,
+        ignore_dot: bool = True,
+        use_ignore_files: bool = True,
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        max_file_size: Optional[int] = None,
+        threads: int = DEFAULT_THREADS,
+    ):
+        self.ignore_dot = ignore_dot
+        self.use_ignore_files = use_ignore_files
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.max_file_size = max_file_size
+        self.threads = threads
+
+    def walk(self, paths: Sequence[str]) -> Iterator[str]:
+        executor = None  # started on the first directory, so searching single files needs no threads.
+        try:
+            for path in paths:
+                if os.path.isdir(path):
+                    if executor is None:
+                        import concurrent.futures
+
+                        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.threads))
+                    yield from self._walk_dir(executor, path)
+                else:
+                    yield path
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _walk_dir(self, executor, root: str) -> Iterator[str]:
+        ignore_files = self._ignore_files_above(root)
+        # Depth-first, like os.walk; but every directory's subdirectories are listed in the
+        # background as soon as it's been listed itself.
+        stack = [executor.submit(self._list, root, root, ignore_files)]
+        while stack:
+            listing = stack.pop().result()
+            yield from listing.files
+            futures = [executor.submit(self._list, subdir, root, listing.ignore_files) for subdir in listing.subdirs]
+            stack.extend(reversed(futures))
+
+    def _ignore_files_above(self, root: str) -> Tuple[IgnoreFile, ...]:
+        """The ignore files in root's parents, up to the top of its git repository."""
+        if not self.use_ignore_files:
+            return ()
+        directory = os.path.abspath(root)
+        found = []
+        while not os.path.exists(os.path.join(directory, '.git')):
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return ()  # not in a git repository.
+            prefix = os.path.relpath(os.path.abspath(root), parent)
+            directory = parent
+            ignore_file = read_ignore_files(directory, root, prefix)
+            if ignore_file is not None:
+                found.append(ignore_file)
+        return tuple(reversed(found))
+
+    def _list(self, directory: str, root: str, ignore_files: Tuple[IgnoreFile, ...]) -> _Listing:
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return _Listing([], [], ignore_files)  # as os.walk does, skip what we can't list.
+
+        if self.use_ignore_files and any(entry.name in IGNORE_FILES for entry in entries):
+            ignore_file = read_ignore_files(directory, directory)
+            if ignore_file is not None:
+                ignore_files = ignore_files + (ignore_file,)
+
+        files, subdirs = [], []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # Like os.walk, don't follow symlinks to directories, or count them as files.
+                if not entry.is_symlink() and self._wants(entry.name, entry.path, root, ignore_files, is_dir=True):
+                    subdirs.append(entry.path)
+            elif self._wants(entry.name, entry.path, root, ignore_files, is_dir=False) and self._small_enough(entry):
+                files.append(entry.path)
+        return _Listing(files, subdirs, ignore_files)
+
+    def _wants(self, name: str, path: str, root: str, ignore_files: Sequence[IgnoreFile], is_dir: bool) -> bool:
+        if self.ignore_dot and name.startswith('.'):
+            return False
+        if self.include or self.exclude:
+            relative = path[len(root):].lstrip(os.sep)
+            if _matches_any(self.exclude, name, relative):
+                return False
+            if not is_dir and self.include and not _matches_any(self.include, name, relative):
+                return False
+        return not (ignore_files and is_ignored(ignore_files, path, is_dir))
+
+    def _small_enough(self, entry: os.DirEntry) -> bool:
+        if self.max_file_size is None:
+            return True
+        try:
+            return entry.stat().st_size <= self.max_file_size
+        except OSError:
+            return False
+
+    def directories(self, root: str) -> Iterator[str]:
+        """The directories that walking root looks in, starting with root itself."""
+        stack = [(root, self._ignore_files_above(root))]
+        while stack:
+            directory, ignore_files = stack.pop()
+            yield directory
+            listing = self._list(directory, root, ignore_files)
+            stack.extend((subdir, listing.ignore_files) for subdir in reversed(listing.subdirs))
+
+    def accepts(self, roots: Sequence[str], path: str, is_dir: bool = False) -> bool:
+        """Whether walking roots would find path, if it's a file, or look in it, if is_dir."""
+        for root in roots:
+            relative = os.path.relpath(path, root)
+            if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+                continue
+            ignore_files = self._ignore_files_above(root)
+            directory = root
+            parts = relative.split(os.sep)
+            for i, part in enumerate(parts):
+                if part == os.curdir:
+                    continue
+                if self.use_ignore_files:
+                    ignore_file = read_ignore_files(directory, directory)
+                    if ignore_file is not None:
+                        ignore_files = ignore_files + (ignore_file,)
+                child = os.path.join(directory, part)
+                if not self._wants(part, child, root, ignore_files, is_dir or i < len(parts) - 1):
+                    break
+                directory = child
+            else:
+                if is_dir:
+                    return True
+                try:
+                    return self.max_file_size is None or os.path.getsize(path) <= self.max_file_size
+                except OSError:
+                    return False
+        return False
@@ -0,0 +1,236 @@
+"""Notice when files change, so that a long-running perg (see `perg.server`) can re-parse just those files.
+
+On linux we use inotify (through ctypes, so there's nothing extra to install); elsewhere, or if
+inotify isn't available (e.g. we've run out of watches), we fall back to polling file mtimes.
+
+Either way, watchers only look at what the given `perg.walk.Walker` would walk: e.g. files in
+gitignored directories (like node_modules) aren't polled, and their directories aren't watched, which
+could otherwise use up the user's inotify watches. inotify still reports changes to files the walker
+would skip (e.g. ignored files in a watched directory), so the caller should check each file with
+`Walker.accepts`.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from typing import Dict
+from typing import Iterator
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+
+from perg.perg import find_files
+from perg.walk import Walker
+
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+class Changes(NamedTuple):
+    changed: Set[str]
+    # Deleted files, or deleted directories, in which case everything under them is gone.
+    deleted: Set[str]
+    # If set, we lost track of what changed, and everything should be looked at again.
+    rescan: bool = False
+
+    def __bool__(self) -> bool:
+        return bool(self.changed or self.deleted or self.rescan)
+
+
+def is_found_under(root: str, path: str) -> bool:
+    """Whether path is under root, and neither it nor any of its parents below root is a dotfile.
+    (find_files([root]) would find it, if it's a file and not ignored.)"""
+    relative = os.path.relpath(path, root)
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return False
+    return not any(part.startswith('.') and part != os.curdir for part in relative.split(os.sep))
+
+
+class PollingWatcher:
+    def __init__(self, paths: Sequence[str], interval: float = DEFAULT_POLL_INTERVAL, walker: Optional[Walker] = None):
+        self.paths = list(paths)
+        self.interval = interval
+        self.walker = walker
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for filename in find_files(self.paths, self.walker):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            snapshot[filename] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def changes(self) -> Changes:
+        """Wait for the next poll, and return what changed since the last one."""
+        time.sleep(self.interval)
+        old, new = self.snapshot, self.take_snapshot()
+        self.snapshot = new
+        return Changes(
+            changed={filename for filename, stat in new.items() if old.get(filename) != stat},
+            deleted=old.keys() - new.keys(),
+        )
+
+    def close(self) -> None:
+        pass
+
+
+# From <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+# How long to keep collecting events after the first one, so that e.g. a `git checkout` touching
+# many files is handled as one batch rather than hundreds.
+INOTIFY_SETTLE_TIME = 0.05
+
+
+class InotifyWatcher:
+    def __init__(self, paths: Sequence[str], walker: Optional[Walker] = None):
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or libc_name is None:
+            raise OSError("inotify is only available on linux")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.walker = Walker() if walker is None else walker
+        # watch descriptor -> the directory it watches
+        self.watches: Dict[int, str] = {}
+        self.roots = [path for path in paths if os.path.isdir(path)]
+        # Paths given as single files (normalized, and as given); we only care about those files in their directories.
+        self.single_files = {os.path.normpath(path): path for path in paths if not os.path.isdir(path)}
+        try:
+            for root in self.roots:
+                for directory in self.walker.directories(root):
+                    self.add_watch(directory)
+            for path in self.single_files.values():
+                self.add_watch(os.path.dirname(path) or os.curdir)
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, directory: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch failed for {directory}: {os.strerror(errno)}")
+        self.watches[wd] = directory
+
+    def wants_directory(self, directory: str) -> bool:
+        return self.walker.accepts(self.roots, directory, is_dir=True)
+
+    def watch_tree(self, directory: str) -> None:
+        """Watch a new directory, and the directories under it that the walker would look in."""
+        self.add_watch(directory)
+        for dirpath, subdirs, _ in os.walk(directory):
+            subdirs[:] = [subdir for subdir in subdirs if self.wants_directory(os.path.join(dirpath, subdir))]
+            for subdir in subdirs:
+                self.add_watch(os.path.join(dirpath, subdir))
+
+    def remove_watches_under(self, directory: str) -> None:
+        for wd, watched in list(self.watches.items()):
+            if is_found_under(directory, watched):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def wanted(self, path: str) -> Optional[str]:
+        """If path is one we're watching, return it as find_files would name it; otherwise, None."""
+        if (single_file := self.single_files.get(os.path.normpath(path))) is not None:
+            return single_file
+        if any(is_found_under(root, path) for root in self.roots):
+            return path
+        return None
+
+    def read_events(self, timeout: Optional[float]) -> Iterator[Tuple[int, int, str]]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            yield wd, mask, name
+
+    def changes(self) -> Changes:
+        """Block until something changes, and return what did."""
+        changes = Changes(set(), set())
+        timeout = None
+        while True:
+            events = list(self.read_events(timeout))
+            if not events and timeout is not None:
+                return changes
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    changes = changes._replace(rescan=True)
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                if wd not in self.watches or not name:
+                    continue
+                path = self.wanted(os.path.join(self.watches[wd], name))
+                if path is None:
+                    continue
+
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    changes.deleted.add(path)
+                    changes.changed.discard(path)
+                    if mask & IN_ISDIR:
+                        self.remove_watches_under(path)
+                elif mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and self.wants_directory(path):
+                        # Anything already in the new directory won't generate its own events.
+                        try:
+                            self.watch_tree(path)
+                        except OSError:
+                            changes = changes._replace(rescan=True)
+                        changes.changed.update(find_files([path], self.walker))
+                else:
+                    changes.changed.add(path)
+                    changes.deleted.discard(path)
+            timeout = INOTIFY_SETTLE_TIME
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def make_watcher(paths: Sequence[str], poll_interval: Optional[float] = None, walker: Optional[Walker] = None):
+    """Watch with inotify if possible, or by polling every poll_interval seconds if that's given or
+    inotify isn't available. `walker` says which files and directories to look at (see perg.walk)."""
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(paths, walker)
+        except OSError:
+            pass
+    return PollingWatcher(paths, DEFAULT_POLL_INTERVAL if poll_interval is None else poll_interval, walker)
@@ -0,0 +1,146 @@
+import importlib.util
+import os
+
+import pytest
+
+import perg.cache
+from perg.cache import PatternCache
+from perg.sniff import FileKind
+from perg.syntaxes import LazySyntax
+from perg.syntaxes import PergSyntaxParseError
+from perg.syntaxes import _treesitter
+from perg.syntaxes import bash
+from perg.syntaxes import python
+
+
+def write(path, contents, mtime_ns=10**18):
+    path.write_text(contents)
+    # Make the file look old enough that its mtime can be trusted.
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_cache_hit_skips_parsing(tmp_path, monkeypatch):
+    source = tmp_path / 'source.py'
+    write(source, 'x = "foo .* bar"\ny = f"foo {x} bar"\n')
+
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        first = cache.get_patterns(python, str(source))
+
+    def fail(f, filename):
+        raise AssertionError("should not have parsed")
+
+    monkeypatch.setattr(python, 'parse', fail)
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        second = cache.get_patterns(python, str(source))
+
+    assert [p.location for p in first] == [p.location for p in second]
+    assert first[0].value == second[0].value == "foo .* bar"
+    assert second[1].value.to_regex() == "foo .* bar"
+    assert first[0].check_fns == second[0].check_fns
+
+
+def test_cache_invalidated_by_content_change(tmp_path):
+    source = tmp_path / 'source.py'
+    write(source, 'x = "foo"\n')
+
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        (pattern,) = cache.get_patterns(python, str(source))
+        assert pattern.value == "foo"
+
+        write(source, 'x = "bar"\n', mtime_ns=10**18 + 1)
+        (pattern,) = cache.get_patterns(python, str(source))
+        assert pattern.value == "bar"
+
+
+def test_cache_remembers_parse_failures(tmp_path, monkeypatch):
+    source = tmp_path / 'source.py'
+    write(source, 'echo "unterminated\n')
+
+    def fail(f, filename):
+        raise PergSyntaxParseError()
+
+    monkeypatch.setattr(bash, 'parse', fail)
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        with pytest.raises(PergSyntaxParseError):
+            cache.get_patterns(bash, str(source))
+
+    monkeypatch.setattr(bash, 'parse', lambda f, filename: [])
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        with pytest.raises(PergSyntaxParseError):
+            cache.get_patterns(bash, str(source))
+
+
+def test_cache_remembers_file_kinds(tmp_path, monkeypatch):
+    source = tmp_path / 'data.bin'
+    source.write_bytes(b'\x00\x01\x02')
+    os.utime(source, ns=(10**18, 10**18))
+
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        assert cache.get_file_kind(str(source)) == (FileKind.BINARY, 3)
+
+    monkeypatch.setattr(perg.cache, 'sniff_source', lambda source: (FileKind.TEXT, 3))
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        assert cache.get_file_kind(str(source)) == (FileKind.BINARY, 3)
+
+
+def test_default_cache_dir_is_outside_searched_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    repo = tmp_path / 'repo'
+    other = tmp_path / 'other'
+    for directory in (repo, other):
+        directory.mkdir()
+
+    cache_dir = perg.cache.default_cache_dir(str(repo))
+    assert cache_dir.startswith(str(tmp_path / 'xdg' / 'perg') + os.sep)
+    assert cache_dir != perg.cache.default_cache_dir(str(other))
+
+    monkeypatch.chdir(repo)
+    assert perg.cache.default_cache_dir() == cache_dir
+    with PatternCache() as cache:
+        assert cache.directory == cache_dir
+    assert os.listdir(repo) == []
+
+
+def test_cache_invalidated_by_shared_module_change(tmp_path, monkeypatch):
+    source = tmp_path / 'source.py'
+    write(source, 'x = "foo"\n')
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        cache.get_patterns(python, str(source))
+
+    parsed = []
+    parse = python.parse
+    monkeypatch.setattr(python, 'parse', lambda f, filename: parsed.append(filename) or parse(f, filename))
+    # As if perg/syntaxes/_treesitter.py had been edited.
+    edited = tmp_path / '_treesitter.py'
+    with open(_treesitter.__file__, 'rb') as f:
+        edited.write_bytes(f.read() + b'# edited\n')
+    find_spec = importlib.util.find_spec
+
+    def find_edited_spec(name, package=None):
+        if name == _treesitter.__name__:
+            return importlib.util.spec_from_file_location(name, edited)
+        return find_spec(name, package)
+
+    monkeypatch.setattr(importlib.util, 'find_spec', find_edited_spec)
+    perg.cache._module_version.cache_clear()
+    try:
+        with PatternCache(str(tmp_path / 'cache')) as cache:
+            (pattern,) = cache.get_patterns(python, str(source))
+    finally:
+        perg.cache._module_version.cache_clear()
+    assert pattern.value == "foo"
+    assert parsed == [str(source)]
+
+
+def test_cache_hit_doesnt_import_syntax(tmp_path):
+    source = tmp_path / 'source.py'
+    write(source, 'x = "foo"\n')
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        cache.get_patterns(python, str(source))
+
+    # A fresh registry entry, so we can see whether it imports its module.
+    syntax = LazySyntax('python')
+    with PatternCache(str(tmp_path / 'cache')) as cache:
+        (pattern,) = cache.get_patterns(syntax, str(source))
+    assert pattern.value == "foo"
+    assert syntax._module is None
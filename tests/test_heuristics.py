@@ -1,8 +1,11 @@
 import math
+from types import SimpleNamespace
+
 from perg import heuristics
 from perg import Pattern
 from perg import Match
 from perg import Location
+from perg.common_checkers import ALL_COMMON
 from perg.common_checkers import check_match_re_simple
 
 def make_pattern(regex):
@@ -164,3 +167,103 @@ def test_information_charclass():
     information = heuristics.information(match)
     expected_information = 8 * len(match.text) - (math.log2(27)) * len("bar")  # 27 = 26 for the alphabet and 1 for deletion
     assert -0.01 <= (expected_information - information) <= 0.01
+
+
+def test_information_analytical_matches_experimental():
+    for pattern, text in [
+        ("foo .* baz", "foo bar baz"),
+        ("foo [a-z]* baz", "foo bar baz"),
+        (".*", "foo bar baz"),
+        (r"\d+-\w{2,4}", "123-ab_c"),
+        ("a(b|cd)?e", "acde"),
+        ("^x[^y]z$", "xqz"),
+        ("[^a]a?[^a]", "bab"),
+        (r"x\s*y", "x \t y"),
+    ]:
+        match = make_match(pattern=pattern, text=text, partial=-1)
+        assert heuristics.analytical_alphabet_sizes(match) is not None
+        assert heuristics.information(match, engine='analytical') == heuristics.information(match)
+
+
+def test_information_analytical_falls_back():
+    # Backreferences aren't regular, and partial matches aren't supported.
+    match = make_match(pattern=r"(\w+) \1", text="foo foo", partial=-1)
+    assert heuristics.analytical_alphabet_sizes(match) is None
+    assert heuristics.information(match, engine='analytical') == heuristics.information(match)
+
+    match = make_match(pattern="foo.*?ba", text="foo bar baz", partial=True)
+    assert heuristics.analytical_alphabet_sizes(match) is None
+
+
+def test_information_early_exit():
+    match = make_match(pattern="foo .* baz", text="foo bar baz", partial=-1)
+    score = heuristics.information(match)
+    assert score <= heuristics.information_upper_bound(match) < 8 * len("foo  baz") + 1
+    assert heuristics.information(match, minimum=score) == score
+    assert heuristics.information(match, minimum=score + 1) is None
+
+
+def test_pattern_matches_single_char_agrees_with_checking_each_char():
+    patterns = [
+        '.*', '.?', '.+', '.', '(.)', '[^\n]', r'\w', '.*x', 'a', '', '%s', '*', '?', '[!a]',
+        r'(.)\1', '(?i).', r'\S|\s', '(?s:.)', '.{0,3}', '[', '(a|.)+', 'x*.',
+    ]
+    trivial = set()
+    for pattern in patterns:
+        for check_fn in ALL_COMMON:
+            # The verdict doesn't depend on the text, so this doesn't need to be a real Match.
+            match = SimpleNamespace(check_fn=check_fn, pattern=make_pattern(pattern))
+            expected = all(check_fn(pattern, chr(c), partial=-1) for c in range(1, 255) if chr(c) != '\n')
+            assert heuristics.pattern_matches_single_char(match) == expected, (pattern, check_fn)
+            if expected:
+                trivial.add((pattern, check_fn.__name__))
+    assert ('.*', 'check_match_re_simple') in trivial
+    assert ('*', 'check_shell_glob') in trivial
+    assert ('(?i).', 'check_match_re_simple') in trivial
+
+
+def test_results_shared_between_locations():
+    calls = []
+
+    def check_fn(pattern, text, partial):
+        calls.append((pattern, text))
+        return check_match_re_simple(pattern, text, partial)
+
+    def match_at(lineno):
+        pattern = Pattern(
+            location=Location(filename="/dev/null", start_lineno=lineno, start_col=0, end_lineno=lineno, end_col=10),
+            value="foo .* baz",
+            check_fns=(check_fn,),
+        )
+        return Match(check_fn=check_fn, pattern=pattern, text="foo bar baz", partial=-1)
+
+    first = match_at(1)
+    score = heuristics.information(first)
+    assert heuristics.deletable_chars(first) == [4, 5, 6]
+    calls.clear()
+
+    second = match_at(2)
+    assert second != first
+    assert heuristics.information(second) == score
+    assert heuristics.deletable_chars(second) == [4, 5, 6]
+    assert calls == []
+
+
+def test_information_upper_bound():
+    for pattern, text in [
+        ("foo .* baz", "foo bar baz"),
+        ("foo .* baz", "foo " + "x" * 1000 + " baz"),
+        ("foo [a-z]* baz", "foo bar baz"),
+        (".*", "foo bar baz"),
+        (r"\d+-\w{2,4}", "123-ab_c"),
+        ("a(b|cd)?e", "acde"),
+        ("(ab|a)*c", "abaabc"),
+        (r"(\w+) \1", "foo foo"),
+    ]:
+        match = make_match(pattern=pattern, text=text, partial=-1)
+        assert heuristics.information(match) <= heuristics.information_upper_bound(match) <= 8 * len(text)
+
+    # Matching .* against a longer text doesn't make a match more promising.
+    short = make_match(pattern="foo .* baz", text="foo bar baz", partial=-1)
+    long = make_match(pattern=".*", text="x" * 1000, partial=-1)
+    assert heuristics.information_upper_bound(long) < heuristics.information_upper_bound(short)
@@ -0,0 +1,106 @@
+import json
+import os
+
+from perg import stats
+from perg.perg import find_files
+from perg.perg import main_search
+from perg.perg import parse_args
+from perg.perg import scan_files
+
+
+def test_parse_threads_find_the_same_matches(tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    source.mkdir()
+    for i in range(20):
+        (source / f'{i:02}.py').write_text(f'x = "foo{i} .*"\n')
+        (source / f'{i:02}.txt').write_text('"bar"\n')
+
+    def matches(*argv):
+        args = parse_args(['foo3 baz', str(source), *argv])
+        return [
+            [(match.pattern.location, match.check_fn) for match in file_matches]
+            for file_matches in scan_files(find_files(args.paths), args)
+        ]
+
+    expected = matches()
+    assert any(expected)
+    assert matches('--parse-threads', '4') == expected
+
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setattr(stats, 'STATS', None)
+    assert matches('--parse-threads', '4', '--cache', '--cache-dir', cache_dir, '--stats') == expected
+    # The .py files get parsed as python, and the .txt files by all three syntaxes.
+    assert stats.STATS.stages['parse'].calls == 20 + 3 * 20
+    assert len(stats.STATS.syntaxes) == 3
+    # Now from the cache.
+    assert matches('--parse-threads', '4', '--cache', '--cache-dir', cache_dir) == expected
+
+
+def test_jobs_find_the_same_matches_and_stream(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    for i in range(200):
+        (source / f'{i:03}.py').write_text(f'x = "foo{i % 7} .*"\n')
+    args = parse_args(['foo3 baz', str(source)])
+    expected = [[(match.pattern.location, match.check_fn) for match in file_matches] for file_matches in scan_files(find_files(args.paths), args)]
+    assert any(expected)
+
+    walked = []
+
+    def walk():
+        for filename in find_files(args.paths):
+            walked.append(filename)
+            yield filename
+
+    args = parse_args(['foo3 baz', str(source), '--jobs', '2'])
+    results = scan_files(walk(), args)
+    first = next(results)
+    # Results come out before the walk is done, rather than after every file has been submitted.
+    assert len(walked) < 200
+    found = [first, *results]
+    assert [[(match.pattern.location, match.check_fn) for match in file_matches] for file_matches in found] == expected
+
+
+def test_queries_from_tags_and_dedups_records(tmp_path, capsys):
+    (tmp_path / 'a.py').write_text('x = "foo .* baz"\n')
+    (tmp_path / 'b.py').write_text('y = "foo b.r baz"\n')
+    (tmp_path / 'c.py').write_text('z = "foo b.r baz"\n')
+    queries = tmp_path / 'queries.txt'
+    queries.write_text('foo bar baz\nfoo qux baz\nfoo bar baz\n')
+
+    # Without a text argument, the first positional argument is a path, not a query.
+    args = parse_args(['--queries-from', str(queries), str(tmp_path / 'a.py'), str(tmp_path / 'b.py')])
+    assert args.text is None
+    assert args.paths == [str(tmp_path / 'a.py'), str(tmp_path / 'b.py')]
+    main_search(args)
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    # One record per (query, location): the repeated query doesn't repeat records, and a location
+    # that matches two queries gets a record for each.
+    assert sorted((record['query'], os.path.basename(record['filename'])) for record in records) == [
+        ('foo bar baz', 'a.py'),
+        ('foo bar baz', 'b.py'),
+        ('foo qux baz', 'a.py'),
+    ]
+    assert all(record['matches'] for record in records)
+
+
+def test_stream_prints_in_file_order_and_respects_min_score(tmp_path, capsys):
+    source = tmp_path / 'source'
+    source.mkdir()
+    for i in range(10):
+        (source / f'{i}.py').write_text('x = "foo .* baz"\ny = "foo .*"\n')
+    # Output follows the order the files are walked in.
+    filenames = list(find_files([str(source)]))
+    assert len(filenames) == 10
+
+    main_search(parse_args(['foo bar baz', str(source), '--stream', '--min-score', '50']))
+    out = capsys.readouterr().out
+    printed = [line.split(':')[:2] for line in out.splitlines() if line]
+    # "foo .*" only implies about half of the text, so only line 1 of each file is printed.
+    assert printed == [[filename, '1'] for filename in filenames]
+
+    main_search(parse_args(['foo bar baz', str(source), '--stream', '--min-score', '0']))
+    out = capsys.readouterr().out
+    assert [line.split(':')[:2] for line in out.splitlines() if line] == [
+        [filename, lineno] for filename in filenames for lineno in ('1', '2')
+    ]
@@ -0,0 +1,40 @@
+import re
+
+from perg import prefilter
+from perg.common_checkers import ALL_COMMON
+from perg.common_checkers import RE_FLAGS
+from perg.common_checkers import check_match_re_simple
+from perg.common_checkers import check_shell_glob
+from perg.common_checkers import check_string_match
+
+
+def test_regex_required_literals():
+    assert set(prefilter.regex_required_literals("foo .* baz", RE_FLAGS)) == {"foo ", " baz"}
+    assert set(prefilter.regex_required_literals("foo(bar)?baz", RE_FLAGS)) == {"foo", "baz"}
+    assert set(prefilter.regex_required_literals("x(bar)+y", RE_FLAGS)) == {"x", "bar", "y"}
+    assert prefilter.regex_required_literals("foo|bar", RE_FLAGS) == ()
+    assert prefilter.regex_required_literals("(?i)foo", RE_FLAGS) == ()
+    assert set(prefilter.regex_required_literals("a(?i:b)c", RE_FLAGS)) == {"a", "c"}
+    assert prefilter.regex_required_literals("foo # comment", RE_FLAGS | re.VERBOSE) == ("foo",)
+    assert prefilter.regex_required_literals("[", RE_FLAGS) == ()
+
+
+def test_required_literals_for_checkers():
+    assert set(prefilter.required_literals(check_shell_glob, "foo*baz")) == {"foo", "baz"}
+    assert prefilter.required_literals(check_string_match, "foo*baz") == ("foo*baz",)
+
+
+def test_prefilter_never_rejects_matches():
+    patterns = ["foo .* baz", "foo(bar)?baz", "a+b", "(?i)FOO", "foo*", "", "%s bar", "[a-z]+ baz", "x{2}"]
+    texts = ["foo bar baz", "FOO", "foobaz", "aab", "xx", "", "hi bar"]
+    for check_fn in ALL_COMMON:
+        for pattern in patterns:
+            for text in texts:
+                for partial in (-1, 1):
+                    if check_fn(pattern, text, partial):
+                        assert prefilter.may_match(check_fn, pattern, text), (check_fn, pattern, text, partial)
+
+
+def test_prefilter_rejects():
+    assert not prefilter.may_match(check_match_re_simple, "foo .* baz", "foo bar qux")
+    assert prefilter.may_match(check_match_re_simple, "foo .* baz", "foo bar baz")
@@ -0,0 +1,65 @@
+import json
+import threading
+
+from perg import server
+
+
+def make_store(*argv):
+    args = server.parse_serve_args(list(argv))
+    store = server.PatternStore(args.paths, args)
+    store.load()
+    return store
+
+
+def test_store_query():
+    store = make_store('test_inputs/foo.py')
+    records = store.query(["foo bar baz", "no pattern in foo.py matches this"])
+    assert records
+    assert {record['query'] for record in records} == {"foo bar baz"}
+    assert {record['filename'] for record in records} == {'test_inputs/foo.py'}
+
+
+def test_store_update_and_remove(tmp_path):
+    source = tmp_path / 'source.py'
+    source.write_text('x = "foo .* baz"\n')
+    store = make_store(str(source))
+    assert store.query(["foo bar baz"])
+
+    source.write_text('x = "qux"\n')
+    store.update(str(source))
+    assert not store.query(["foo bar baz"])
+
+    store.remove(str(source))
+    assert store.files == {}
+
+
+def test_serve_and_query(tmp_path):
+    socket_path = str(tmp_path / 'perg.sock')
+    store = make_store('test_inputs/foo.py')
+    with server.bind_server(socket_path, store) as perg_server:
+        thread = threading.Thread(target=perg_server.serve_forever)
+        thread.start()
+        try:
+            expected = json.loads(json.dumps(store.query(["foo bar baz"])))
+            assert server.send_queries(socket_path, ["foo bar baz"]) == expected
+            assert 'error' in server.send_queries(socket_path, [1])[0]
+        finally:
+            perg_server.shutdown()
+            thread.join()
+
+
+def test_store_skips_files_that_fail_to_parse(tmp_path, capsys):
+    good = tmp_path / 'good.py'
+    good.write_text('x = "foo .* baz"\n')
+    # The python syntax trips an assertion on this escape sequence.
+    bad = tmp_path / 'bad.py'
+    bad.write_text("x = '\\ '\n")
+    store = make_store(str(tmp_path))
+    assert list(store.files) == [str(good)]
+    assert f"skipping {bad}" in capsys.readouterr().err
+    assert store.query(["foo bar baz"])
+
+    # e.g. a half-edited file, saved under --watch.
+    good.write_text("x = '\\ '\n")
+    store.update(str(good))
+    assert store.files == {}
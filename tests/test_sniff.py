@@ -0,0 +1,40 @@
+from perg.perg import find_syntaxes
+from perg.perg import parse_args
+from perg.perg import parse_file_patterns
+from perg.sniff import FileKind
+from perg.sniff import sniff_bytes
+
+
+def test_sniff_bytes():
+    assert sniff_bytes(b'x = "foo"\n') is FileKind.TEXT
+    assert sniff_bytes('x = "héllo"\n'.encode()) is FileKind.TEXT
+    # Cut off in the middle of a character.
+    assert sniff_bytes('héllo'.encode()[:2]) is FileKind.TEXT
+    assert sniff_bytes(b'\x7fELF\x02\x01\x01\x00') is FileKind.BINARY
+    assert sniff_bytes('x'.encode('utf-16')) is FileKind.BINARY
+    assert sniff_bytes(b'caf\xe9 "foo"') is FileKind.NOT_UTF8
+
+
+def syntaxes_tried(path, *argv):
+    args = parse_args(['foo', *argv])
+    return sorted(syntax.__name__ for syntax, _ in parse_file_patterns(str(path), find_syntaxes(), args))
+
+
+def test_skips_files_that_cant_have_patterns(tmp_path):
+    text = tmp_path / 'notes.txt'
+    text.write_text('x = "foo"\n')
+    assert syntaxes_tried(text) == ['perg.syntaxes.bash', 'perg.syntaxes.general', 'perg.syntaxes.python']
+
+    binary = tmp_path / 'image.dat'
+    binary.write_bytes(b'"foo"\x00\x00')
+    assert syntaxes_tried(binary) == []
+
+    latin1 = tmp_path / 'latin1.txt'
+    latin1.write_bytes(b'caf\xe9 "foo"\n')
+    assert syntaxes_tried(latin1) == []
+
+    # Too big to guess at, but still parsed by a syntax that recognizes it.
+    assert syntaxes_tried(text, '--max-guess-size', '4') == []
+    source = tmp_path / 'big.py'
+    source.write_text('x = "foo"\n')
+    assert syntaxes_tried(source, '--max-guess-size', '4') == ['perg.syntaxes.python']
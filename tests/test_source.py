@@ -0,0 +1,57 @@
+from perg import source as source_module
+from perg.source import LineIndex
+from perg.syntaxes import general
+from perg.syntaxes import open_source
+from perg.syntaxes import python
+from perg.syntaxes import read_source_bytes
+
+
+def test_line_index():
+    lines = LineIndex(b"foo\nbar\r\n\nbaz\n")
+    assert len(lines) == 4
+    assert [lines.line(i) for i in range(1, 5)] == ["foo", "bar", "", "baz"]
+
+
+def test_line_index_no_trailing_newline():
+    lines = LineIndex("foo\nbär".encode())
+    assert len(lines) == 2
+    assert lines.line(2) == "bär"
+
+
+def test_line_index_from_file(tmp_path):
+    empty = tmp_path / 'empty'
+    empty.write_bytes(b"")
+    assert len(LineIndex.from_file(str(empty))) == 0
+
+    source = tmp_path / 'source'
+    source.write_bytes(b"a\nb\n")
+    lines = LineIndex.from_file(str(source))
+    assert len(lines) == 2
+    assert lines.line(2) == "b"
+
+
+def test_line_index_survives_truncation(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_bytes(b"a\n" * 10000)
+    lines = LineIndex.from_file(str(source))
+    # If the file were memory-mapped, reading past the new end would kill us with SIGBUS.
+    source.write_bytes(b"")
+    assert lines.line(10000) == "a"
+
+
+def test_source_file_read_once_for_all_syntaxes(tmp_path, monkeypatch):
+    path = tmp_path / 'source.py'
+    path.write_bytes(b'x = "foo"\r\ny = "bar"\r\n')
+
+    reads = []
+    read_file = source_module.read_file
+    monkeypatch.setattr(source_module, 'read_file', lambda filename: reads.append(filename) or read_file(filename))
+
+    shared = source_module.SourceFile(str(path))
+    with open_source(python, shared) as f:
+        assert read_source_bytes(f) == b'x = "foo"\ny = "bar"\n'
+    with open_source(general, shared) as f:
+        assert f.read() == 'x = "foo"\ny = "bar"\n'
+    with open_source(general, shared) as f:
+        assert list(f) == ['x = "foo"\n', 'y = "bar"\n']
+    assert reads == [str(path)]
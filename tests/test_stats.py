@@ -0,0 +1,55 @@
+import io
+
+import pytest
+
+from perg import stats
+from perg.perg import parse_args
+from perg.perg import scan_file
+from perg.perg import find_syntaxes
+
+
+@pytest.fixture(autouse=True)
+def reset_stats(monkeypatch):
+    monkeypatch.setattr(stats, 'STATS', None)
+
+
+def test_merge_and_prune():
+    run_stats = stats.Stats(top=1)
+    run_stats.count('checker calls', 2)
+    run_stats.file_seconds['a.py'] = 1.0
+
+    worker_stats = stats.Stats(top=1)
+    worker_stats.add('parse', stats.clock(), items=3, syntax='perg.syntaxes.python')
+    worker_stats.count('checker calls', 5)
+    worker_stats.file_seconds.update({'b.py': 2.0, 'c.py': 0.5})
+    worker_stats.prune()
+    assert worker_stats.file_seconds == {'b.py': 2.0}
+
+    run_stats.merge(worker_stats)
+    assert run_stats.counts == {'checker calls': 7}
+    assert run_stats.stages['parse'].calls == 1
+    assert run_stats.stages['parse'].items == 3
+    assert run_stats.syntaxes['perg.syntaxes.python'].items == 3
+    assert run_stats.file_seconds == {'a.py': 1.0, 'b.py': 2.0}
+
+
+def test_scan_file_with_stats(tmp_path):
+    source = tmp_path / 'source.py'
+    source.write_text('x = "foo .* baz"\ny = ".*"\n')
+    args = parse_args(['--stats-top', '5', 'foo bar baz', str(tmp_path)])
+    assert args.stats
+    run_stats = stats.STATS
+    assert run_stats is not None
+
+    matches = scan_file(str(source), find_syntaxes(), args)
+    assert {str(match.pattern.value) for match in matches} == {"foo .* baz"}
+    assert run_stats.stages['parse'].items == 2
+    assert run_stats.stages['first_pass'].calls == 2
+    assert run_stats.counts['pattern_matches_single_char: calls'] >= 1
+    assert list(run_stats.file_seconds) == [str(source)]
+    assert len(run_stats.pattern_seconds) == 2
+
+    out = io.StringIO()
+    run_stats.report(out)
+    assert 'perg.syntaxes.python' in out.getvalue()
+    assert 'slowest patterns:' in out.getvalue()
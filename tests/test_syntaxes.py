@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+import perg
+from perg.perg import find_syntaxes
+from perg.syntaxes import LazySyntax
+from perg.syntaxes import Relevance
+from perg.syntaxes import SYNTAXES
+
+
+def test_relevance_checked_without_importing():
+    syntax = LazySyntax('python', yes=('.py', '.pyi'), no=('.pyc',))
+    assert syntax.check_relevance('foo.py') is Relevance.YES
+    assert syntax.check_relevance('foo.pyc') is Relevance.NO
+    assert syntax.check_relevance('foo.txt') is Relevance.MAYBE
+    assert syntax._module is None
+
+    assert syntax.BINARY
+    assert syntax._module is sys.modules['perg.syntaxes.python']
+
+
+def test_find_syntaxes_uses_registry():
+    assert find_syntaxes() == [SYNTAXES['bash'], SYNTAXES['general'], SYNTAXES['python']]
+    assert find_syntaxes(['python']) == [SYNTAXES['python']]
+
+
+def test_unused_syntaxes_not_imported(tmp_path):
+    binary = tmp_path / 'image.dat'
+    binary.write_bytes(b'"foo"\x00\x00')
+    code = (
+        "import sys\n"
+        "from perg.perg import main\n"
+        f"sys.argv = ['perg', 'foo', {str(binary)!r}]\n"
+        "main()\n"
+        "print(sorted(m for m in sys.modules if m.startswith(('perg.syntaxes.', 'tree_sitter')) or m == 'pdb'))\n"
+    )
+    root = os.path.dirname(os.path.dirname(perg.__file__))
+    env = dict(os.environ, PYTHONPATH=root)
+    result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
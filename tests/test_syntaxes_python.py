@@ -40,3 +40,18 @@ def test_node_to_string():
     assert source_to_node_to_text(r'"x \234 y"') == 'x \234 y'
     assert source_to_node_to_text(r'"x \u1234 y"') == 'x \u1234 y'
     assert source_to_node_to_text(r'"x \U00000020 y"') == 'x \U00000020 y'
+
+
+def test_parse_deeply_nested():
+    # Deeper than python's recursion limit.
+    source = '[' * 3000 + '"foo .* bar"' + ']' * 3000 + '\n'
+    (pattern,) = list(python.parse(StringIO(source), 'source.py'))
+    assert pattern.value == "foo .* bar"
+
+
+def test_identical_f_strings_are_equal():
+    source = 'a = f"hello {x}"\nb = f"hello {y}"\nc = f"bye {x}"\n'
+    a, b, c = (pattern.value for pattern in python.parse(StringIO(source), 'source.py'))
+    assert a == b and hash(a) == hash(b)
+    assert a != c
+    assert str(a) == "hello .*"
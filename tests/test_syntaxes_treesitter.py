@@ -0,0 +1,128 @@
+import concurrent.futures
+import io
+import random
+
+import pytest
+
+from perg.syntaxes import _treesitter
+from perg.syntaxes import bash
+from perg.syntaxes import python
+
+
+def test_compute_edit():
+    assert _treesitter.compute_edit(b"abc", b"abc") is None
+
+    edit = _treesitter.compute_edit(b"x = 1\ny = 'foo'\nz = 3\n", b"x = 1\ny = 'foobar'\nz = 3\n")
+    assert edit == _treesitter.Edit(
+        start_byte=14,
+        old_end_byte=14,
+        new_end_byte=17,
+        start_point=(1, 8),
+        old_end_point=(1, 8),
+        new_end_point=(1, 11),
+    )
+
+    # The common prefix and suffix can't overlap.
+    edit = _treesitter.compute_edit(b"aa", b"aaa")
+    assert (edit.start_byte, edit.old_end_byte, edit.new_end_byte) == (2, 2, 3)
+
+
+def test_compute_edit_across_chunks(monkeypatch):
+    monkeypatch.setattr(_treesitter, '_DIFF_CHUNK', 4)
+    old = b"0123456789" * 10
+    new = old[:37] + b"XY" + old[40:]
+    edit = _treesitter.compute_edit(old, new)
+    assert (edit.start_byte, edit.old_end_byte, edit.new_end_byte) == (37, 40, 39)
+
+
+def test_parser_pool_loads_language_when_first_used():
+    loaded = []
+    pool = _treesitter.ParserPool(lambda: loaded.append(True) or python.load_language())
+    assert loaded == []
+    pool.parse(b"x = 1\n")
+    pool.parse(b"y = 2\n")
+    assert loaded == [True]
+
+
+PYTHON_SOURCE = '''
+x = "foo .* baz"
+def f(a):
+    return f"hello {a}, how are you?"
+
+y = ["one", "two",
+     "three %s"]
+'''
+
+BASH_SOURCE = '''
+echo "foo $bar baz"
+cat <<EOF
+hello $name
+EOF
+ls *.txt
+'''
+
+SNIPPETS = ['"', "'", 'x', '\n', ' "new string" ', 'f"{x}"', '$y', '(', ')', '#']
+
+
+def parse(syntax, source):
+    """Parse source, returning something comparable: the patterns, or the type of error raised."""
+    try:
+        patterns = syntax.parse(io.BytesIO(source.encode()), 'file')
+        return [(pattern.location, str(pattern.value), pattern.check_fns) for pattern in patterns]
+    except Exception as e:
+        return type(e)
+
+
+@pytest.mark.parametrize('syntax, source', [(python, PYTHON_SOURCE), (bash, BASH_SOURCE)])
+def test_incremental_reparse_matches_full_parse(syntax, source, monkeypatch):
+    rng = random.Random(1234)
+    for _ in range(300):
+        start = rng.randrange(len(source) + 1)
+        end = min(len(source), start + rng.randrange(4))
+        edited = source[:start] + rng.choice(SNIPPETS + ['']) + source[end:]
+
+        monkeypatch.setattr(_treesitter, 'MAX_KEPT_TREES', 0)
+        expected = parse(syntax, edited)
+
+        monkeypatch.setattr(_treesitter, 'MAX_KEPT_TREES', 1)
+        parse(syntax, source)
+        assert parse(syntax, edited) == expected, (source, edited)
+        if isinstance(expected, list):
+            source = edited
+
+
+@pytest.mark.parametrize('syntax, source', [(python, PYTHON_SOURCE), (bash, BASH_SOURCE)])
+def test_reparse_with_errors_parses_cold(syntax, source, monkeypatch):
+    monkeypatch.setattr(_treesitter, 'MAX_KEPT_TREES', 1)
+    parse(syntax, source)
+
+    calls = []
+    parse_source = syntax.parsers.parse
+
+    def spy(source, old_tree=None):
+        calls.append(old_tree is not None)
+        return parse_source(source, old_tree)
+
+    monkeypatch.setattr(syntax.parsers, 'parse', spy)
+    edited = source.replace('"foo', '"foo"(', 1)
+    result = parse(syntax, edited)
+    # The incremental parse found an error, so the file was parsed again from scratch.
+    assert calls == [True, False]
+
+    monkeypatch.setattr(_treesitter, 'MAX_KEPT_TREES', 0)
+    assert result == parse(syntax, edited)
+
+
+@pytest.mark.parametrize('syntax, source', [(python, PYTHON_SOURCE), (bash, BASH_SOURCE)])
+def test_parsing_in_threads(syntax, source):
+    expected = parse(syntax, source)
+    parsers = set()
+
+    def parse_in_thread(_):
+        parsers.add(id(syntax.parsers.parser))
+        return parse(syntax, source)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(parse_in_thread, range(32)))
+    assert results == [expected] * 32
+    assert id(syntax.parsers.parser) not in parsers
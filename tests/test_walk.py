@@ -0,0 +1,106 @@
+import os
+
+from perg.walk import Walker
+from perg.walk import parse_ignore_file
+from perg.walk import is_ignored
+from perg.walk import IgnoreFile
+
+
+def make_tree(root, files):
+    for path, contents in files.items():
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(contents)
+
+
+def walk(root, **kwargs):
+    return sorted(os.path.relpath(path, root) for path in Walker(**kwargs).walk([str(root)]))
+
+
+def test_ignore_rules():
+    ignore_file = IgnoreFile('root', '', parse_ignore_file([
+        '# a comment',
+        '*.log',
+        '!keep.log',
+        'build/',
+        '/top.txt',
+        'docs/*.md',
+        '**/generated/**',
+    ]))
+
+    def ignored(path, is_dir=False):
+        return is_ignored([ignore_file], os.path.join('root', path), is_dir)
+
+    assert ignored('a.log')
+    assert ignored('sub/a.log')
+    assert not ignored('keep.log')
+    assert ignored('build', is_dir=True)
+    assert not ignored('build')  # only directories
+    assert ignored('sub/build', is_dir=True)
+    assert ignored('top.txt')
+    assert not ignored('sub/top.txt')
+    assert ignored('docs/index.md')
+    assert not ignored('docs/sub/index.md')
+    assert ignored('x/generated/y.py')
+    assert not ignored('# a comment')
+
+
+def test_walk_honours_ignore_files(tmp_path):
+    make_tree(tmp_path, {
+        '.gitignore': 'node_modules/\n*.min.js\n',
+        'src/app.js': '',
+        'src/app.min.js': '',
+        'src/.ignore': '!app.min.js\nvendored/\n',
+        'src/vendored/lib.js': '',
+        'node_modules/pkg/index.js': '',
+        '.hidden/x.py': '',
+        '.a/x.py': '',
+        'lib/.b/x.py': '',
+        'lib/y.py': '',
+    })
+    assert walk(tmp_path) == ['lib/y.py', 'src/app.js', 'src/app.min.js']
+    assert 'node_modules/pkg/index.js' in walk(tmp_path, use_ignore_files=False)
+
+
+def test_walk_globs_and_size(tmp_path):
+    make_tree(tmp_path, {
+        'a.py': 'x',
+        'b.sh': 'x' * 100,
+        'tests/c.py': '',
+        'tests/d.txt': '',
+    })
+    assert walk(tmp_path, include=['*.py']) == ['a.py', 'tests/c.py']
+    assert walk(tmp_path, exclude=['tests']) == ['a.py', 'b.sh']
+    assert walk(tmp_path, exclude=['tests/*.py']) == ['a.py', 'b.sh', 'tests/d.txt']
+    assert walk(tmp_path, max_file_size=10) == ['a.py', 'tests/c.py', 'tests/d.txt']
+
+
+def test_walk_order_matches_os_walk(tmp_path):
+    make_tree(tmp_path, {f'{a}/{b}/{c}.py': '' for a in 'abc' for b in 'xyz' for c in range(3)})
+    expected = [os.path.join(root, f) for root, _, files in os.walk(str(tmp_path)) for f in files]
+    assert list(Walker(threads=4).walk([str(tmp_path)])) == expected
+
+
+def test_accepts(tmp_path):
+    make_tree(tmp_path, {'.gitignore': 'build/\n', 'build/out.py': '', 'src/a.py': '', 'src/b.txt': ''})
+    walker = Walker(exclude=['*.txt'])
+    assert walker.accepts([str(tmp_path)], str(tmp_path / 'src' / 'a.py'))
+    assert not walker.accepts([str(tmp_path)], str(tmp_path / 'src' / 'b.txt'))
+    assert not walker.accepts([str(tmp_path)], str(tmp_path / 'build' / 'out.py'))
+    assert not walker.accepts([str(tmp_path / 'src')], str(tmp_path / 'build' / 'out.py'))
+    assert walker.accepts([str(tmp_path)], str(tmp_path / 'src'), is_dir=True)
+    assert not walker.accepts([str(tmp_path)], str(tmp_path / 'build'), is_dir=True)
+
+
+def test_directories(tmp_path):
+    make_tree(tmp_path, {
+        '.gitignore': 'node_modules/\n',
+        'node_modules/dep/index.js': '',
+        '.git/config': '',
+        'src/a.py': '',
+        'src/lib/b.py': '',
+        'vendor/c.py': '',
+    })
+    walker = Walker(exclude=['vendor'])
+    assert list(walker.directories(str(tmp_path))) == [str(tmp_path), str(tmp_path / 'src'), str(tmp_path / 'src' / 'lib')]
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from perg import server
+from perg import watch
+from perg.walk import Walker
+
+
+def test_is_found_under():
+    assert watch.is_found_under('src', 'src/foo.py')
+    assert watch.is_found_under('.', './src/foo.py')
+    assert not watch.is_found_under('src', 'src/.git/config')
+    assert not watch.is_found_under('src', 'src/.hidden.py')
+    assert not watch.is_found_under('src', 'other/foo.py')
+
+
+def test_polling_watcher(tmp_path):
+    (tmp_path / 'a.py').write_text('x = 1\n')
+    (tmp_path / 'b.py').write_text('y = 2\n')
+    watcher = watch.PollingWatcher([str(tmp_path)], interval=0)
+
+    (tmp_path / 'a.py').write_text('x = 10\n')
+    os.remove(tmp_path / 'b.py')
+    (tmp_path / 'c.py').write_text('z = 3\n')
+    changes = watcher.changes()
+    assert changes.changed == {str(tmp_path / 'a.py'), str(tmp_path / 'c.py')}
+    assert changes.deleted == {str(tmp_path / 'b.py')}
+
+    assert not watcher.changes()
+
+
+def test_inotify_watcher(tmp_path):
+    try:
+        watcher = watch.InotifyWatcher([str(tmp_path)])
+    except OSError:
+        pytest.skip("inotify isn't available")
+
+    try:
+        (tmp_path / 'a.py').write_text('x = 1\n')
+        (tmp_path / '.hidden.py').write_text('x = 1\n')
+        changes = watcher.changes()
+        assert changes.changed == {str(tmp_path / 'a.py')}
+
+        (tmp_path / 'sub').mkdir()
+        changes = watcher.changes()
+        (tmp_path / 'sub' / 'b.py').write_text('y = 2\n')
+        changes = watcher.changes()
+        assert changes.changed == {str(tmp_path / 'sub' / 'b.py')}
+
+        os.remove(tmp_path / 'a.py')
+        changes = watcher.changes()
+        assert changes.deleted == {str(tmp_path / 'a.py')}
+    finally:
+        watcher.close()
+
+
+def test_polling_watcher_uses_walker(tmp_path):
+    (tmp_path / '.gitignore').write_text('node_modules/\n')
+    (tmp_path / 'node_modules').mkdir()
+    (tmp_path / 'node_modules' / 'dep.js').write_text('x = 1\n')
+    (tmp_path / 'big.py').write_text('x = 1\n')
+    watcher = watch.PollingWatcher([str(tmp_path)], interval=0, walker=Walker(max_file_size=100))
+    assert watcher.snapshot.keys() == {str(tmp_path / 'big.py')}
+
+    (tmp_path / 'node_modules' / 'dep.js').write_text('x = 2\n')
+    (tmp_path / 'big.py').write_text('x = 1\n' * 100)
+    changes = watcher.changes()
+    assert changes.changed == set()
+    assert changes.deleted == {str(tmp_path / 'big.py')}
+
+
+def test_inotify_watcher_skips_ignored_directories(tmp_path):
+    (tmp_path / '.gitignore').write_text('node_modules/\nbuild/\n')
+    (tmp_path / 'node_modules' / 'dep').mkdir(parents=True)
+    (tmp_path / 'src').mkdir()
+    try:
+        watcher = watch.InotifyWatcher([str(tmp_path)], Walker())
+    except OSError:
+        pytest.skip("inotify isn't available")
+
+    try:
+        assert sorted(watcher.watches.values()) == [str(tmp_path), str(tmp_path / 'src')]
+
+        (tmp_path / 'build').mkdir()
+        (tmp_path / 'lib').mkdir()
+        watcher.changes()
+        assert sorted(watcher.watches.values()) == [str(tmp_path), str(tmp_path / 'lib'), str(tmp_path / 'src')]
+    finally:
+        watcher.close()
+
+
+def test_store_apply(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    source = tmp_path / 'sub' / 'source.py'
+    source.write_text('x = "foo .* baz"\n')
+    args = server.parse_serve_args([str(tmp_path)])
+    store = server.PatternStore(args.paths, args)
+    store.load()
+    assert store.query(["foo bar baz"])
+
+    store.apply(watch.Changes(changed=set(), deleted={str(tmp_path / 'sub')}))
+    assert not store.query(["foo bar baz"])
+
+    store.apply(watch.Changes(changed=set(), deleted=set(), rescan=True))
+    assert store.query(["foo bar baz"])